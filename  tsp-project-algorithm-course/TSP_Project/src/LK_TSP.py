@@ -9,22 +9,32 @@
  which describes the original Lin-Kernighan(1973) approach
  as well as their modifications.
 
- Tested with python 2.6.1.
+ Tested with python 2.6.1 ; requires numpy.
   
  Jim Mahoney | Marlboro College | GPL
 
  history
    Nov 2010 - working version while Richard Scrugs was around.
    Apr 2011 - profiling etc for algorithms course
+   Oct 2026 - coordinate arrays and roads created only when needed
  
 """
 
+import os
 import re
 import time
 import math
 import random
+import pickle
+import hashlib
 import doctest
+import ctypes
+import collections
+import multiprocessing
+import multiprocessing.sharedctypes
+import numpy
 from svg_graph import SvgGraph
+import tsplib
 
 class memoized(object):
   # from http://wiki.python.org/moin/PythonDecoratorLibrary#Memoize  
@@ -85,17 +95,802 @@ def permutations(collection):
 def proper_permutations(collection):
   """ Generate the subset of permutations of collection[]
       without cyclic or reverse variants. To do this, we fix
-      the 0th element of the subset and require that 1st < 2nd.
+      the 0th element of the subset and require that 1st < last.
       This corresponds to the different traveling salesman paths,
       since a given path can be started at any city and traversed
       in either direction.
       >>> list(proper_permutations("abcd"))
-      ['abcd', 'acdb', 'abdc']
+      ['abcd', 'acbd', 'abdc']
   """
   for permutation in permutations(collection[1:]):
-    if permutation[0] < permutation[1]:
+    if permutation[0] < permutation[-1]:
       yield collection[0:1] + permutation
 
+def distance_matrix(xy, block=256):
+  """ Return the (N,N) numpy array of distances between the N rows
+      of the (N,2) coordinate array xy. It's computed a block of rows
+      at a time to keep the temporary arrays small.
+      >>> xy = numpy.array([[0.0, 0.0], [3.0, 4.0], [6.0, 8.0]])
+      >>> distance_matrix(xy).tolist()
+      [[0.0, 5.0, 10.0], [5.0, 0.0, 5.0], [10.0, 5.0, 0.0]]
+  """
+  n = len(xy)
+  distances = numpy.empty((n, n))
+  (x, y) = (xy[:, 0], xy[:, 1])
+  for i in range(0, n, block):
+    dx = x[i:i+block, numpy.newaxis] - x
+    dy = y[i:i+block, numpy.newaxis] - y
+    distances[i:i+block] = numpy.sqrt(dx*dx + dy*dy)
+  return distances
+
+def monotonic_clock():
+  """ Return a function giving the time in seconds from a clock
+      that (unlike time.time) doesn't jump when the system time is set,
+      or time.time if there isn't one.
+      >>> t = clock(); clock() >= t
+      True
+  """
+  if hasattr(time, 'monotonic'):               # python 3.3+
+    return time.monotonic
+  try:                                         # POSIX clock_gettime
+    import ctypes, ctypes.util
+    class timespec(ctypes.Structure):
+      _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+    librt = ctypes.CDLL(ctypes.util.find_library('rt') or
+                        ctypes.util.find_library('c'))
+    clock_gettime = librt.clock_gettime
+    CLOCK_MONOTONIC = 1
+    def clock():
+      t = timespec()
+      if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+        raise OSError('clock_gettime failed')
+      return t.tv_sec + 1e-9 * t.tv_nsec
+    clock()
+    return clock
+  except (ImportError, OSError, AttributeError, TypeError):
+    return time.time
+
+clock = monotonic_clock()
+
+def double_bridge(sequence, i, j, k):
+  """ Return the double bridge kick of a tour sequence A B C D
+      into A C B D, where B starts at i, C at j, and D at k.
+      >>> double_bridge('abcdefgh', 2, 4, 6)
+      'abefcdgh'
+  """
+  # Of the 4 roads between A, B, C, D (and D back to A) this
+  # replaces 3, in a way that an LK search can't easily undo.
+  return sequence[:i] + sequence[j:k] + sequence[i:j] + sequence[k:]
+
+def shared_array(array):
+  """ Return a copy of a numpy array in shared memory, which
+      worker processes forked from this one use without copying;
+      an array that's already there is returned as it is.
+      >>> a = shared_array(numpy.arange(6.0).reshape(2, 3))
+      >>> row = a[1]
+      >>> (a.tolist(), shared_array(a) is a, shared_array(row) is row)
+      ([[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]], True, True)
+  """
+  base = array
+  while base is not None:
+    if isinstance(base, ctypes.Array):
+      return array
+    base = getattr(base, 'base', None)
+  raw = multiprocessing.sharedctypes.RawArray('b', max(array.nbytes, 1))
+  shared = numpy.frombuffer(raw, dtype=array.dtype, count=array.size)
+  shared = shared.reshape(array.shape)
+  shared[...] = array
+  return shared
+
+def instance_key(xy):
+  """ Return a hash of an (N,2) coordinate array, which names its cache.
+      >>> xy = numpy.array([[0.0, 1.0], [2.0, 3.0]])
+      >>> instance_key(xy) == instance_key(xy.copy()) != instance_key(xy[::-1])
+      True
+  """
+  xy = numpy.ascontiguousarray(xy, dtype=float)
+  return hashlib.sha1(str(xy.shape) + xy.tostring()).hexdigest()
+
+def save_array(directory, name, array):
+  """ Write an array to directory/name.npy, all at once or not at all. """
+  # Renaming a finished file over the old one is atomic, so a reader
+  # (or another process saving the same thing) never sees half of it.
+  filename = os.path.join(directory, name + '.npy')
+  temporary = '%s.%i.tmp' % (filename, os.getpid())
+  f = open(temporary, 'wb')
+  try:
+    numpy.save(f, numpy.asarray(array))
+  finally:
+    f.close()
+  os.rename(temporary, filename)
+
+
+class GridIndex(object):
+  """ A spatial index of the points in an (N,2) coordinate array,
+      which buckets them into square cells with about per_cell points
+      in each, so that nearest neighbors can be found by looking
+      in a few nearby cells rather than at all N**2 pairs.
+      >>> xy = numpy.array([[0.0, 0.0], [1.0, 0.0], [5.0, 0.0], [0.0, 2.0]])
+      >>> GridIndex(xy).k_nearest(2).tolist()
+      [[1, 3], [0, 3], [1, 0], [0, 1]]
+  """
+  # The points are sorted by cell, so those in cell c are
+  #   self.order[self.starts[c] : self.starts[c+1]]
+  # where c = cy*self.nx + cx for column cx and row cy.
+  # Building this is O(N log N); finding the k nearest for every point
+  # is then about O(N k), since points more than r cells away from a
+  # point's own cell are at least r*self.size away from it.
+
+  def __init__(self, xy, per_cell=2.0):
+    self.xy = xy
+    n = len(xy)
+    if n == 0:
+      (lo, hi) = (numpy.zeros(2), numpy.zeros(2))
+    else:
+      (lo, hi) = (xy.min(axis=0), xy.max(axis=0))
+    (width, height) = hi - lo
+    if width * height > 0:
+      self.size = math.sqrt(width * height * per_cell / n)
+    else:
+      self.size = max(width, height) * per_cell / max(n, 1) or 1.0
+    self.nx = int(width / self.size) + 1
+    self.ny = int(height / self.size) + 1
+    cx = numpy.minimum(((xy[:, 0] - lo[0]) / self.size).astype(int), self.nx-1)
+    cy = numpy.minimum(((xy[:, 1] - lo[1]) / self.size).astype(int), self.ny-1)
+    cells = cy * self.nx + cx
+    self.order = numpy.argsort(cells, kind='mergesort')
+    self.starts = numpy.searchsorted(cells[self.order],
+                                     numpy.arange(self.nx * self.ny + 1))
+
+  def cell_points(self, cx, cy):
+    """ Return the indices of the points in cell (cx, cy). """
+    c = cy * self.nx + cx
+    return self.order[self.starts[c]:self.starts[c+1]]
+
+  def ring_points(self, cx, cy, r):
+    """ Return the indices of the points in the cells which are
+        exactly r cells away from cell (cx, cy), as a list of arrays. """
+    if r == 0:
+      return [self.cell_points(cx, cy)]
+    points = []
+    for x in range(max(cx-r, 0), min(cx+r, self.nx-1) + 1):
+      for y in (cy-r, cy+r):
+        if 0 <= y < self.ny:
+          points.append(self.cell_points(x, y))
+    for y in range(max(cy-r+1, 0), min(cy+r-1, self.ny-1) + 1):
+      for x in (cx-r, cx+r):
+        if 0 <= x < self.nx:
+          points.append(self.cell_points(x, y))
+    return points
+
+  def k_nearest(self, k):
+    """ Return an (N, k) integer array whose row i lists the indices
+        of the k points nearest to point i (not including i), nearest first.
+        If there are fewer than k other points, k is reduced to fit. """
+    n = len(self.xy)
+    k = max(min(k, n - 1), 0)
+    nearest = numpy.empty((n, k), dtype=int)
+    if k == 0:
+      return nearest
+    max_r = max(self.nx, self.ny)
+    for cy in range(self.ny):
+      for cx in range(self.nx):
+        members = self.cell_points(cx, cy)
+        if len(members) == 0:
+          continue
+        (found, r) = ([], 0)
+        while True:
+          found.extend(self.ring_points(cx, cy, r))
+          candidates = numpy.concatenate(found)
+          if len(candidates) > k or r >= max_r:
+            delta = self.xy[members, numpy.newaxis, :] - self.xy[candidates]
+            dist = numpy.sqrt((delta * delta).sum(axis=2))
+            dist[members[:, numpy.newaxis] == candidates] = numpy.inf
+            kth = numpy.partition(dist, k-1, axis=1)[:, k-1]
+            if r >= max_r or (kth <= r * self.size).all():
+              break
+          r += 1
+        columns = numpy.argpartition(dist, k-1, axis=1)[:, :k]
+        rows = numpy.arange(len(members))[:, numpy.newaxis]
+        columns = columns[rows, numpy.argsort(dist[rows, columns], axis=1,
+                                              kind='mergesort')]
+        nearest[members] = candidates[columns]
+    return nearest
+
+
+# - - - tour construction - - -
+#
+# Each of these takes the (N,2) coordinate array and an (N,k) array of
+# nearest neighbors (as from GridIndex.k_nearest), and returns a list of
+# city indices in tour order.  They're O(N log N) or so, apart from
+# patching up the occasional city or fragment which has run out of
+# near neighbors, and give tours that are typically 15-40% longer than
+# optimal rather than the 5 or more times longer of a random one.
+
+def candidate_edges(xy, neighbors):
+  """ Return (a, b, lengths) arrays of the distinct edges a[i]--b[i]
+      from each point to its nearest neighbors, shortest first.
+      >>> xy = numpy.array([[0.0, 0.0], [1.0, 0.0], [3.0, 0.0]])
+      >>> [e.tolist() for e in candidate_edges(xy, GridIndex(xy).k_nearest(1))]
+      [[0, 1], [1, 2], [1.0, 2.0]]
+  """
+  (n, k) = neighbors.shape
+  i = numpy.repeat(numpy.arange(n), k)
+  j = neighbors.ravel()
+  keys = numpy.unique(numpy.minimum(i, j) * n + numpy.maximum(i, j))
+  (a, b) = (keys // n, keys % n)
+  delta = xy[a] - xy[b]
+  lengths = numpy.sqrt((delta * delta).sum(axis=1))
+  order = numpy.argsort(lengths, kind='mergesort')
+  return (a[order], b[order], lengths[order])
+
+def nearest_point(xy, point, candidates):
+  """ Return the one of the candidates indices nearest to xy[point]. """
+  delta = xy[candidates] - xy[point]
+  return candidates[numpy.argmin((delta * delta).sum(axis=1))]
+
+def nearest_neighbor_tour(xy, neighbors, start=0):
+  """ Return a tour which starts at start and always goes on
+      to the nearest city not yet visited.
+      >>> xy = numpy.array([[0.0, 0.0], [5.0, 0.0], [1.0, 0.0], [2.0, 1.0]])
+      >>> nearest_neighbor_tour(xy, GridIndex(xy).k_nearest(1))
+      [0, 2, 3, 1]
+  """
+  n = len(xy)
+  if n == 0:
+    return []
+  neighbors = neighbors.tolist()
+  visited = numpy.zeros(n, dtype=bool)
+  (visited[start], tour, city) = (True, [start], start)
+  for step in range(n - 1):
+    for next_city in neighbors[city]:
+      if not visited[next_city]:
+        break
+    else:                           # all its neighbors are in the tour
+      next_city = nearest_point(xy, city, numpy.flatnonzero(~visited))
+    visited[next_city] = True
+    tour.append(next_city)
+    city = next_city
+  return tour
+
+def join_fragments(xy, adjacent, start=None):
+  """ Return a tour made from the paths given by the lists of adjacent
+      points (two for inside points, one or none for ends), by walking
+      along each path and then jumping to the nearest end of another,
+      beginning at the given end (or the first one). """
+  n = len(adjacent)
+  ends = numpy.array([p for p in range(n) if len(adjacent[p]) < 2], dtype=int)
+  used = numpy.zeros(n, dtype=bool)
+  if start == None:
+    start = ends[0] if len(ends) else 0
+  (tour, end) = ([], start)
+  while True:
+    (previous, point) = (None, end)
+    while point != None:              # walk along this path
+      used[point] = True
+      tour.append(int(point))
+      (previous, point) = (point, ([p for p in adjacent[point]
+                                    if p != previous and not used[p]]
+                                   or [None])[0])
+    ends = ends[~used[ends]]
+    if len(ends) == 0:
+      return tour
+    end = nearest_point(xy, tour[-1], ends)
+
+def greedy_tour(xy, neighbors):
+  """ Return a greedy edge matching tour, which is made by taking the
+      candidate edges shortest first, skipping any that would give
+      a city three roads or close a loop.
+      >>> xy = numpy.array([[0.0, 0.0], [5.0, 0.0], [1.0, 0.0], [2.0, 1.0]])
+      >>> greedy_tour(xy, GridIndex(xy).k_nearest(2))
+      [0, 2, 3, 1]
+  """
+  n = len(xy)
+  adjacent = [[] for i in range(n)]
+  fragment = range(n)             # union-find; fragment[i]==i for a root
+  def root(i):
+    while fragment[i] != i:
+      fragment[i] = fragment[fragment[i]]
+      i = fragment[i]
+    return i
+  (a, b, lengths) = candidate_edges(xy, neighbors)
+  for (i, j) in zip(a.tolist(), b.tolist()):
+    if len(adjacent[i]) < 2 and len(adjacent[j]) < 2:
+      (root_i, root_j) = (root(i), root(j))
+      if root_i != root_j:
+        fragment[root_i] = root_j
+        adjacent[i].append(j)
+        adjacent[j].append(i)
+  return join_fragments(xy, adjacent)
+
+def spacefill_tour(xy, neighbors=None, bits=16):
+  """ Return the tour that visits the cities in the order of a
+      Hilbert space-filling curve over their bounding square.
+      >>> xy = numpy.array([[0.0, 0.0], [1.0, 1.0], [0.0, 1.0], [1.0, 0.0]])
+      >>> spacefill_tour(xy)
+      [0, 2, 1, 3]
+  """
+  if len(xy) == 0:
+    return []
+  lo = xy.min(axis=0)
+  size = (xy.max(axis=0) - lo).max() or 1.0
+  side = 2 ** bits
+  (x, y) = ((xy - lo) * ((side - 1) / size)).astype(numpy.int64).T
+  curve = numpy.zeros(len(xy), dtype=numpy.int64)
+  s = side // 2
+  while s > 0:
+    rx = (x & s) > 0
+    ry = (y & s) > 0
+    curve += s * s * ((3 * rx) ^ ry)
+    flip = ~ry & rx                 # rotate the quadrant to match
+    (x[flip], y[flip]) = (side - 1 - x[flip], side - 1 - y[flip])
+    swap = ~ry
+    (x[swap], y[swap]) = (y[swap], x[swap])
+    s //= 2
+  return numpy.argsort(curve, kind='mergesort').tolist()
+
+def christofides_tour(xy, neighbors):
+  """ Return a Christofides-like tour : a minimum spanning tree
+      (over the candidate edges) plus a greedy (not minimum) matching
+      of its odd degree cities, whose Euler circuit is shortcut
+      past the cities seen before.
+      >>> xy = numpy.array([[0.0, 0.0], [5.0, 0.0], [1.0, 0.0], [2.0, 1.0]])
+      >>> christofides_tour(xy, GridIndex(xy).k_nearest(2))
+      [0, 2, 3, 1]
+  """
+  n = len(xy)
+  if n < 3:
+    return range(n)
+  adjacent = [[] for i in range(n)]
+  def link(i, j):
+    adjacent[i].append(j)
+    adjacent[j].append(i)
+  component = range(n)            # union-find, as in greedy_tour
+  def root(i):
+    while component[i] != i:
+      component[i] = component[component[i]]
+      i = component[i]
+    return i
+  (a, b, lengths) = candidate_edges(xy, neighbors)
+  (a, b) = (a.tolist(), b.tolist())
+  for (i, j) in zip(a, b):                  # Kruskal
+    (root_i, root_j) = (root(i), root(j))
+    if root_i != root_j:
+      component[root_i] = root_j
+      link(i, j)
+  roots = numpy.array([root(i) for i in range(n)])
+  while (roots != roots[0]).any():          # join any separate clusters
+    outside = numpy.flatnonzero(roots != roots[0])
+    inside = numpy.flatnonzero(roots == roots[0])
+    (d, i, j) = min([(numpy.hypot(*(xy[j] - xy[i])), i, j) for i in inside
+                     for j in [nearest_point(xy, i, outside)]])
+    link(i, j)
+    roots[roots == roots[j]] = roots[0]
+  odd = numpy.array([len(adjacent[i]) % 2 == 1 for i in range(n)])
+  for (i, j) in zip(a, b):                  # greedy matching
+    if odd[i] and odd[j]:
+      odd[i] = odd[j] = False
+      link(i, j)
+  unmatched = numpy.flatnonzero(odd)
+  while len(unmatched):
+    (i, unmatched) = (unmatched[0], unmatched[1:])
+    j = nearest_point(xy, i, unmatched)
+    unmatched = unmatched[unmatched != j]
+    link(i, j)
+  # Hierholzer's Euler circuit, shortcut to the first visit of each city.
+  (tour, seen, stack) = ([], numpy.zeros(n, dtype=bool), [0])
+  while stack:
+    i = stack[-1]
+    if adjacent[i]:
+      j = adjacent[i].pop()
+      adjacent[j].remove(i)
+      stack.append(j)
+    else:
+      stack.pop()
+      if not seen[i]:
+        seen[i] = True
+        tour.append(i)
+  return tour
+
+tour_constructions = {'nearest': nearest_neighbor_tour,
+                      'greedy': greedy_tour,
+                      'spacefill': spacefill_tour,
+                      'christofides': christofides_tour}
+
+# - - - exact solution - - -
+
+def held_karp(distances, processes=None):
+  """ Return (length, tour) for the shortest tour of the cities with
+      this (N,N) distances array, as a list of indices starting at 0,
+      by Held and Karp's dynamic programming over subsets of cities.
+      This takes O(2**N N**2) time and O(2**N N) memory,
+      so N is limited to about 20.
+      If processes is given, each step is shared out among that many
+      worker processes (-1 => one per cpu).
+      >>> xy = numpy.array([[0, 0], [2, 2], [0, 2], [2, 0], [1, 3]])
+      >>> (length, tour) = held_karp(distance_matrix(xy))
+      >>> ("%.4f" % length, tour)
+      ('8.8284', [0, 3, 1, 4, 2])
+      >>> held_karp(distance_matrix(xy), processes=2) == (length, tour)
+      True
+  """
+  # cost[s, j] is the length of the shortest path that starts at city 0,
+  # goes through the set of other cities given by the bits of s, and
+  # ends at the j'th of 'em; parent[s, j] is the one before j on it.
+  # Each step fills in the sets of one size, which only need
+  # the smaller ones, all at once.
+  n = len(distances)
+  m = n - 1
+  if m < 1:
+    return (0.0, range(n))
+  d = distances[1:, 1:]
+  n_sets = 1 << m
+  (cost, parent) = (numpy.empty((n_sets, m)), numpy.zeros((n_sets, m), 'int8'))
+  if processes != None:
+    if processes < 0:
+      processes = multiprocessing.cpu_count()
+    (cost, parent) = (shared_array(cost), shared_array(parent))
+  cost.fill(numpy.inf)
+  cost[1 << numpy.arange(m), numpy.arange(m)] = distances[0, 1:]
+  sets = numpy.arange(n_sets, dtype=numpy.int64)
+  size = numpy.zeros(n_sets, dtype=int)
+  for j in range(m):
+    size += (sets >> j) & 1
+  by_size = numpy.argsort(size, kind='mergesort')
+  starts = numpy.searchsorted(size[by_size], numpy.arange(m + 2))
+  layers = [by_size[starts[k]:starts[k+1]] for k in range(m + 1)]
+  if processes == None:
+    for k in range(2, m + 1):
+      held_karp_step(cost, parent, d, layers[k], range(m))
+  else:
+    pool = multiprocessing.Pool(processes, _pool_held_karp_init,
+                                (cost, parent, d, layers))
+    try:
+      for k in range(2, m + 1):
+        pool.map(_pool_held_karp_step,
+                 [(k, range(m)[i::processes]) for i in range(processes)])
+    finally:
+      pool.terminate()
+      pool.join()
+  closing = cost[-1] + distances[1:, 0]
+  j = int(closing.argmin())
+  (s, path) = (n_sets - 1, [])
+  while s:
+    path.append(j + 1)
+    (s, j) = (s ^ (1 << j), parent[s, j])
+  return (closing.min(), [0] + path[::-1])
+
+def held_karp_step(cost, parent, d, layer, columns):
+  """ Fill in cost[s, j] and parent[s, j] for the sets s of the
+      same size in layer, and the given columns j; see held_karp(). """
+  for j in columns:
+    ending = layer[(layer >> j) & 1 == 1]
+    paths = cost[ending ^ (1 << j)] + d[:, j]
+    before = paths.argmin(axis=1)
+    cost[ending, j] = paths[numpy.arange(len(ending)), before]
+    parent[ending, j] = before
+
+# - - - lower bounds - - -
+
+def spanning_tree(xy, pi):
+  """ Return (order, parent, lengths) for the minimum spanning tree of
+      all the points xy but point 0, with the road from i to j counted
+      as its length plus pi[i] + pi[j].  It's rooted at order[0] == 1,
+      every other point i is joined to parent[i] (which comes earlier
+      in order) by a road of (penalized) length lengths[i].
+      >>> xy = numpy.array([[0.0, 0.0], [3.0, 0.0], [3.0, 4.0], [0.0, 4.0]])
+      >>> [a.tolist() for a in spanning_tree(xy, numpy.zeros(4))]
+      [[1, 2, 3], [0, 1, 1, 2], [-inf, -inf, 4.0, 3.0]]
+  """
+  # Prim's algorithm over the whole graph, with the distances from
+  # each newly added point computed as needed, so this is O(N**2)
+  # time but only O(N) memory.  (A tree over just the candidate roads
+  # can be longer than the true one, which wouldn't give a bound.)
+  n = len(xy)
+  (x, y) = (xy[:, 0], xy[:, 1])
+  outside = numpy.ones(n, dtype=bool)
+  nearest = numpy.empty(n)
+  nearest.fill(numpy.inf)
+  parent = numpy.zeros(n, dtype=int)
+  lengths = numpy.empty(n)
+  lengths.fill(-numpy.inf)
+  order = [1]
+  (outside[0], outside[1], newest) = (False, False, 1)
+  parent[1] = 1
+  for step in range(n - 2):
+    d = numpy.hypot(x - x[newest], y - y[newest]) + pi + pi[newest]
+    closer = outside & (d < nearest)
+    nearest[closer] = d[closer]
+    parent[closer] = newest
+    newest = nearest.argmin()
+    lengths[newest] = nearest[newest]
+    (outside[newest], nearest[newest]) = (False, numpy.inf)
+    order.append(newest)
+  return (numpy.array(order), parent, lengths)
+
+def one_tree(xy, pi):
+  """ Return (length, degrees) of the minimum 1-tree of the points xy,
+      with the road from i to j counted as its length plus pi[i] + pi[j].
+      That's a minimum spanning tree of all but point 0, plus
+      the two shortest roads from point 0 ; every tour is a 1-tree,
+      so this is no longer than the shortest tour (plus 2*sum(pi)).
+      >>> xy = numpy.array([[0.0, 0.0], [3.0, 0.0], [3.0, 4.0], [0.0, 4.0]])
+      >>> (length, degrees) = one_tree(xy, numpy.zeros(4))
+      >>> (length, degrees.tolist())
+      (14.0, [2, 2, 2, 2])
+  """
+  n = len(xy)
+  (order, parent, lengths) = spanning_tree(xy, pi)
+  branches = order[1:]
+  d = numpy.hypot(xy[:, 0] - xy[0, 0], xy[:, 1] - xy[0, 1]) + pi + pi[0]
+  d[0] = numpy.inf
+  two = numpy.argpartition(d, 1)[:2]
+  length = lengths[branches].sum() + d[two].sum()
+  degrees = (numpy.bincount(branches, minlength=n) +
+             numpy.bincount(parent[branches], minlength=n) +
+             numpy.bincount(two, minlength=n))
+  degrees[0] = 2
+  return (length, degrees)
+
+def held_karp_bound(xy, upper_bound, iterations=100):
+  """ Return (lower_bound, pi), the best Held-Karp lower bound on
+      the shortest tour length found by this many iterations of
+      subgradient optimization of the one_tree() penalties pi,
+      given the length of some tour as upper_bound.
+      >>> xy = numpy.array([[0, 0], [2, 2], [0, 2], [2, 0], [1, 3]])
+      >>> "%.4f" % held_karp_bound(xy, 9.0)[0]
+      '8.8284'
+  """
+  # Each pass raises pi for the cities of degree > 2 in the 1-tree and
+  # lowers it for the leaves, which makes the next 1-tree more tour-like.
+  # The step is Polyak's, (upper - lower) / |degrees - 2|**2, times a
+  # factor which is halved whenever a few steps have failed to help.
+  n = len(xy)
+  if n < 3:
+    return (upper_bound, numpy.zeros(n))
+  pi = numpy.zeros(n)
+  (best, best_pi, factor, stalled) = (-numpy.inf, pi, 2.0, 0)
+  for i in range(iterations):
+    (length, degrees) = one_tree(xy, pi)
+    bound = length - 2 * pi.sum()
+    if bound > best + 1e-9:
+      (best, best_pi, stalled) = (bound, pi, 0)
+    else:
+      stalled += 1
+      if stalled >= 5:
+        (factor, stalled) = (factor / 2, 0)
+    direction = degrees - 2
+    norm = (direction * direction).sum()
+    if norm == 0:                        # the 1-tree is a tour
+      break
+    pi = pi + factor * (upper_bound - bound) / norm * direction
+  return (best, best_pi)
+
+def tree_path_max(order, parent, lengths, a, b):
+  """ Return the array of the longest road on the path between
+      each a[i] and b[i] in the spanning_tree (order, parent, lengths),
+      by jumping up the tree by powers of two.
+      >>> (order, parent) = (numpy.array([1, 2, 3, 4]), numpy.array([0, 1, 1, 2, 2]))
+      >>> lengths = numpy.array([0.0, -numpy.inf, 5.0, 1.0, 2.0])
+      >>> tree_path_max(order, parent, lengths, numpy.array([3, 3, 1]),
+      ...                                        numpy.array([4, 1, 2])).tolist()
+      [2.0, 5.0, 5.0]
+  """
+  depth = numpy.zeros(len(parent), dtype=int)
+  for i in order[1:].tolist():
+    depth[i] = depth[parent[i]] + 1
+  (up, longest) = ([parent], [lengths])
+  while (1 << len(up)) <= depth.max():
+    (u, m) = (up[-1], longest[-1])
+    up.append(u[u])
+    longest.append(numpy.maximum(m, m[u]))
+  swap = depth[a] < depth[b]
+  (a, b) = (numpy.where(swap, b, a), numpy.where(swap, a, b))
+  result = numpy.empty(len(a))
+  result.fill(-numpy.inf)
+  climb = depth[a] - depth[b]
+  for k in range(len(up)):                 # raise a to b's depth
+    jump = (climb >> k) & 1 == 1
+    result[jump] = numpy.maximum(result[jump], longest[k][a[jump]])
+    a = numpy.where(jump, up[k][a], a)
+  for k in reversed(range(len(up))):       # then both to just below
+    jump = up[k][a] != up[k][b]            # their common ancestor
+    result[jump] = numpy.maximum(result[jump], numpy.maximum(
+      longest[k][a[jump]], longest[k][b[jump]]))
+    (a, b) = (numpy.where(jump, up[k][a], a), numpy.where(jump, up[k][b], b))
+  last = a != b
+  result[last] = numpy.maximum(result[last], numpy.maximum(
+    lengths[a[last]], lengths[b[last]]))
+  return result
+
+def alpha_nearest(xy, pi, neighbors, k):
+  """ Return an (N, k) array whose row i is the k points with the
+      smallest alpha-nearness to point i, among its neighbors and
+      the points next to it in the minimum 1-tree with penalties pi.
+      The alpha of the road from i to j is how much longer the 1-tree
+      has to be to include it; it's 0 for the 1-tree's own roads.
+      >>> xy = numpy.array([[0, 0], [1, 0], [2, 0], [10, 0], [11, 0]])
+      >>> alpha_nearest(xy, numpy.zeros(5), GridIndex(xy).k_nearest(2), 2)
+      array([[1, 2],
+             [0, 2],
+             [1, 0],
+             [4, 2],
+             [3, 2]])
+      >>> alpha_nearest(xy[:2], numpy.zeros(2), numpy.array([[1], [0]]), 3)
+      array([[1],
+             [0]])
+  """
+  # This is Helsgaun's candidate set for LKH (2000), but with the
+  # alphas found only for the nearby points rather than all of them.
+  # With the penalties pi from held_karp_bound(), the 1-tree is nearly
+  # a tour, and its roads are far better candidates than the nearest
+  # ones, particularly between clusters of points.
+  n = len(xy)
+  k = max(min(k, n - 1), 0)
+  (order, parent, lengths) = spanning_tree(xy, pi)
+  branches = order[1:]
+  d0 = numpy.hypot(xy[:, 0] - xy[0, 0], xy[:, 1] - xy[0, 1]) + pi + pi[0]
+  d0[0] = numpy.inf
+  two = numpy.argpartition(d0, 1)[:min(2, n - 1)]   # 0's two 1-tree roads
+  a = numpy.concatenate([numpy.repeat(numpy.arange(n), neighbors.shape[1]),
+                         branches, parent[branches], [0, 0], two])
+  b = numpy.concatenate([neighbors.ravel(),
+                         parent[branches], branches, two, [0, 0]])
+  keys = numpy.unique((a * n + b)[a != b])           # no road from i to i
+  (a, b) = (keys // n, keys % n)
+  roads = numpy.hypot(*(xy[a] - xy[b]).T) + pi[a] + pi[b]
+  alpha = numpy.empty(len(a))
+  inside = (a != 0) & (b != 0)
+  alpha[inside] = roads[inside] - tree_path_max(order, parent, lengths,
+                                                a[inside], b[inside])
+  alpha[~inside] = roads[~inside] - d0[two].max()
+  alpha = numpy.maximum(alpha, 0.0)
+  ranked = numpy.lexsort((roads, alpha, a))
+  starts = numpy.searchsorted(a[ranked], numpy.arange(n))
+  rank = numpy.arange(len(a)) - starts[a[ranked]]
+  return b[ranked[rank < k]].reshape(n, k)
+
+# - - - spatial partitioning - - -
+#
+# For instances too big to search as a whole, Karp's approach is to cut
+# the plane into cells of at most a few hundred cities, find a tour of
+# each one, and patch the tours together.  The cells come from a k-d
+# tree, so each holds about the same number of cities; they're visited
+# in the space-filling curve order of their centers, so that each one
+# is next to the one before, and each cell's tour is spliced into the
+# tour so far with the cheapest exchange of two roads with the last cell.
+
+def kd_cells(xy, cell_size):
+  """ Return a list of arrays of point indices, the cells of a k-d tree
+      of the points xy with at most cell_size points in each, which is
+      made by splitting the longer side of each cell at its median point.
+      The cells are in the order of a space-filling curve through them.
+      >>> xy = numpy.array([[0.0, 0.0], [0.0, 1.0], [9.0, 0.0], [9.0, 1.0],
+      ...                   [1.0, 0.0], [8.0, 1.0]])
+      >>> [sorted(cell.tolist()) for cell in kd_cells(xy, 3)]
+      [[0, 1, 4], [2, 3, 5]]
+  """
+  (cells, stack) = ([], [numpy.arange(len(xy))])
+  while stack:
+    cell = stack.pop()
+    if len(cell) <= max(cell_size, 1):
+      cells.append(cell)
+      continue
+    points = xy[cell]
+    axis = numpy.argmax(points.max(axis=0) - points.min(axis=0))
+    half = len(cell) // 2
+    order = numpy.argsort(points[:, axis], kind='mergesort')
+    stack.extend([cell[order[:half]], cell[order[half:]]])
+  centers = numpy.array([xy[cell].mean(axis=0) for cell in cells])
+  return [cells[i] for i in spacefill_tour(centers.reshape(-1, 2))]
+
+def splice_tours(xy, tours):
+  """ Return one tour through all the points in the list of tours, each
+      a list of point indices, by splicing each one into the tour so far
+      in place of one of its roads next to the tour before it.
+      >>> xy = numpy.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0],
+      ...                   [2.0, 0.0], [3.0, 0.0], [3.0, 1.0], [2.0, 1.0]])
+      >>> splice_tours(xy, [[0, 1, 2, 3], [4, 5, 6, 7]])
+      [0, 1, 4, 5, 6, 7, 2, 3]
+  """
+  # The tour so far is kept as an array of each point's successor.
+  # Putting tour B = b ... b' between a and a' = succ[a] of tour A
+  # swaps roads a--a' and b--b' for either a--b' ... b--a' or
+  # a--b ... b'--a', whichever is shorter; only roads from the previous
+  # tour are tried, so each splice is O(len(A) len(B)).
+  def distance(i, j):
+    delta = xy[i] - xy[j]
+    return numpy.sqrt((delta * delta).sum(axis=-1))
+  succ = numpy.zeros(len(xy), dtype=int)
+  tour = numpy.asarray(tours[0], dtype=int)
+  succ[tour] = numpy.roll(tour, -1)
+  for (previous, tour) in zip(tours[:-1], tours[1:]):
+    (a, tour) = (numpy.asarray(previous, dtype=int),
+                 numpy.asarray(tour, dtype=int))
+    a2 = succ[a]
+    (b, b2) = (tour, numpy.roll(tour, -1))
+    removed = distance(a, a2)[:, numpy.newaxis] + distance(b, b2)
+    (a, a2) = (a[:, numpy.newaxis], a2[:, numpy.newaxis])
+    forward = distance(a, b2) + distance(b, a2) - removed
+    backward = distance(a, b) + distance(b2, a2) - removed
+    if forward.min() <= backward.min():
+      (i, j) = numpy.unravel_index(numpy.argmin(forward), forward.shape)
+      inserted = numpy.roll(tour, -(j + 1))          # b' ... b
+    else:
+      (i, j) = numpy.unravel_index(numpy.argmin(backward), backward.shape)
+      inserted = numpy.roll(tour[::-1], j + 1)       # b ... b'
+    (a, a2) = (a[i, 0], a2[i, 0])
+    succ[inserted] = numpy.roll(inserted, -1)
+    (succ[a], succ[inserted[-1]]) = (inserted[0], a2)
+  (order, point) = ([], tours[0][0])
+  for step in range(len(xy)):
+    order.append(int(point))
+    point = succ[point]
+  return order
+
+# - - - multilevel - - -
+#
+# Walshaw's multilevel approach : merge each city with a near neighbor
+# to get a problem half the size, and again and again until it's small;
+# solve that, and then undo the merges one level at a time, with each
+# merged pair of cities put back in the tour in place of their midpoint
+# and a quick LK search to tidy up.  The long range structure of the tour
+# is settled on the small problems, so the LK searches on the big ones
+# only have short range fixes to make.
+
+def coarsen(xy, neighbors):
+  """ Return (coarse_xy, first, last) : about half as many points as xy,
+      made by merging the pairs of points i--j of the shortest candidate
+      edges (from the nearest neighbors) that don't share a point.
+      Coarse point c is the midpoint of xy[first[c]] and xy[last[c]],
+      which are the same point for those that weren't paired up.
+      >>> xy = numpy.array([[0.0, 0.0], [0.0, 1.0], [4.0, 2.0], [4.0, 3.0],
+      ...                   [8.0, 0.0]])
+      >>> (coarse_xy, first, last) = coarsen(xy, GridIndex(xy).k_nearest(1))
+      >>> (coarse_xy.tolist(), first.tolist(), last.tolist())
+      ([[0.0, 0.5], [4.0, 2.5], [8.0, 0.0]], [0, 2, 4], [1, 3, 4])
+  """
+  matched = numpy.zeros(len(xy), dtype=bool)
+  (first, last) = ([], [])
+  (a, b, lengths) = candidate_edges(xy, neighbors)
+  for (i, j) in zip(a.tolist(), b.tolist()):
+    if not matched[i] and not matched[j]:
+      matched[i] = matched[j] = True
+      first.append(i)
+      last.append(j)
+  single = numpy.flatnonzero(~matched)
+  first = numpy.concatenate((numpy.array(first, dtype=int), single))
+  last = numpy.concatenate((numpy.array(last, dtype=int), single))
+  return ((xy[first] + xy[last]) / 2.0, first, last)
+
+def uncoarsen(xy, coarse_xy, order, first, last):
+  """ Return the tour of the points xy given by the tour order of
+      coarse_xy from coarsen(), with each coarse point replaced by its
+      first and last, in the order that's shorter from the point before
+      to the coarse point after.
+      >>> xy = numpy.array([[0.0, 0.0], [0.0, 1.0], [4.0, 2.0], [4.0, 3.0],
+      ...                   [8.0, 0.0]])
+      >>> (coarse_xy, first, last) = coarsen(xy, GridIndex(xy).k_nearest(1))
+      >>> uncoarsen(xy, coarse_xy, [0, 1, 2], first, last)
+      [0, 1, 3, 2, 4]
+  """
+  def distance(p, q):
+    return math.hypot(p[0] - q[0], p[1] - q[1])
+  (tour, n) = ([], len(order))
+  (xy_list, coarse_list) = (xy.tolist(), coarse_xy.tolist())
+  for k in range(n):
+    c = order[k]
+    (i, j) = (int(first[c]), int(last[c]))
+    if i != j:
+      before = xy_list[tour[-1]] if tour else coarse_list[order[k-1]]
+      after = coarse_list[order[(k+1) % n]]
+      if distance(before, xy_list[j]) + distance(xy_list[i], after) < \
+         distance(before, xy_list[i]) + distance(xy_list[j], after):
+        (i, j) = (j, i)
+      tour.append(i)
+    tour.append(j)
+  return tour
+
 
 class City(object):
   """ A node in a TSP graph.
@@ -110,10 +905,20 @@ class City(object):
       True
       >>> random_city.name[0] == '#'
       True
+      >>> boston == City('Boston', 1.0, 1.0)    # a different city
+      False
 
-      Don't modify a city's (name,x,y);
-      it's hash, id, and string are set when created.
+      Don't modify a city's (name,x,y); its string is made from them
+      the first time it's asked for.
   """
+  # There are lots of these, and the LK search puts them in sets and
+  # dictionaries over and over, so they have __slots__ rather than a
+  # __dict__ and use python's builtin identity for hash and == ;
+  # no two City objects are the same city.  Within a TSP, a city is
+  # also identified by its integer .index, its row in tsp.xy .
+  # Only the ordering (which sorts a Road's two cities) is by name.
+
+  __slots__ = ('name', 'x', 'y', 'tsp', 'index', '_str')
 
   _count = 0
   _grid_width = 100.0    # (x,y) random coords are 0 to this
@@ -129,25 +934,32 @@ class City(object):
     else:
       self.y = y
     self.name = name or ('#' + str(City._count))
-    self.tsp = None       # Initialized within TSP.init()
-    self.roads = Roads()  #  ditto
-    # This string representation is set only once.
-    self._str = "%s (%4.2f, %4.2f)" % (self.name, self.x, self.y)
-    self._id = id(self._str)
+    self.tsp = None       # Initialized within TSP.init_TSP()
+    self.index = None     #  ditto; this is city's row in tsp.xy
+    self._str = None
 
   def random_coord(self):
     return City._grid_width * random.random()
 
   def __str__(self):
+    if self._str == None:
+      self._str = "%s (%4.2f, %4.2f)" % (self.name, self.x, self.y)
     return self._str
 
-  def __hash__(self):
-    # Set hash equivalence to depend on the string representation,
-    # not the default object id.
-    return self._id
+  def _order(self):
+    return (self.name, self.x, self.y)
 
-  def __cmp__(self, other):
-    return cmp(self._str, str(other))
+  def __lt__(self, other):
+    return self._order() < other._order()
+
+  def __le__(self, other):
+    return self._order() <= other._order()
+
+  def __gt__(self, other):
+    return self._order() > other._order()
+
+  def __ge__(self, other):
+    return self._order() >= other._order()
 
 
 class Listy(list):
@@ -174,7 +986,7 @@ class Listy(list):
                                 str(self[-2]) + ", " + str(self[-1]))
 
 
-class Road(Listy):
+class Road(object):
   """ An edge in a TSP graph connecting two Cities.         #          r3
       Don't modify its cities after it's created.           #     D -------C
       >>> (a, b) = (City('A', 0, 2), City('B', 0, 3))       #  r2 |/ 
@@ -186,54 +998,71 @@ class Road(Listy):
       True
       >>> str(r1.other(a))  # r1 city at the other end from A
       'B (0.00, 3.00)'
+      >>> (r2[0].name, r2[1].name, len(r2))
+      ('A', 'D', 2)
   """
-  # I'm storing these in (road[0], road[1]) sorted alphabetically,
+  # I'm storing these in (road[0], road[1]) = road.ends sorted alphabetically,
   # but intend to treat it as the same road in either direction.
-
-  def __init__(self, city1, city2):
-    super(Road, self).__init__(sorted([city1, city2]))
-    self.length = math.sqrt((city1.x - city2.x)**2 + (city1.y - city2.y)**2)
-    self._str = "%s--%s (%4.2f)" % (self[0].name, self[1].name, self.length)
-    self._id = id(self._str)
-    self._cmp = (self.length, self._str)
-    self._other = {self[0]:self[1], self[1]:self[0]}
+  #
+  # Like City, it's hashed by identity : a TSP's RoadCache makes only
+  # one Road for each pair of cities, and files it under the integer
+  # .key = i*N + j for the city indices i < j.  (Roads made by hand,
+  # outside of a TSP, have key None.)  Roads sort by length, and then
+  # by name only for roads of the same length.
+
+  __slots__ = ('ends', 'length', 'key', '_str')
+
+  def __init__(self, city1, city2, length=None, key=None):
+    if city2 < city1:
+      (city1, city2) = (city2, city1)
+    self.ends = (city1, city2)
+    if length == None:
+      length = math.sqrt((city1.x - city2.x)**2 + (city1.y - city2.y)**2)
+    self.length = length
+    self.key = key
+    self._str = None
 
   def other(self, city):
     """ Return city at other end of road. """
-    return self._other[city]
+    (city1, city2) = self.ends
+    if city is city1:
+      return city2
+    elif city is city2:
+      return city1
+    raise KeyError(city)
 
-  def __str__(self):
-    return self._str
+  def __getitem__(self, i):
+    return self.ends[i]
 
-  def __hash__(self):
-    # Set these as OK as use dictionary keys and set elements.
-    # Otherwise, python is unhappy about using 'em that way,
-    # since they inherit from mutable lists.
-    return id(self._id)
+  def __iter__(self):
+    return iter(self.ends)
 
-  # And since this inherits from list, it already has <, >, etc.
-  # This unfortunately means that just defining __cmp__ won't work,
-  # since the others take precedence.  Python calls these "rich comparisons";
-  # see http://docs.python.org/library/functools.html#functools.total_ordering
-  # and http://docs.python.org/reference/datamodel.html#object.__lt__ .
+  def __len__(self):
+    return 2
 
-  def __eq__(self, other):
-    return self._str == str(other)
+  def __str__(self):
+    if self._str == None:
+      self._str = "%s--%s (%4.2f)" % \
+                  (self.ends[0].name, self.ends[1].name, self.length)
+    return self._str
 
   # The following comparisons will fail when comparing a Road with non-Road.
   # So don't do that.
 
+  def compare(self, other):
+    return cmp(self.length, other.length) or cmp(str(self), str(other))
+
   def __lt__(self, other):
-    return self._cmp < other._cmp
+    return self.compare(other) < 0
 
   def __le__(self, other):
-    return self._cmp <= other._cmp
+    return self.compare(other) <= 0
 
   def __gt__(self, other):
-    return self._cmp > other._cmp
+    return self.compare(other) > 0
 
   def __ge__(self, other):
-    return self._cmp <= other._cmp
+    return self.compare(other) >= 0
 
 
 class Cities(Listy):
@@ -268,6 +1097,8 @@ class Cities(Listy):
       cities = []
     super(Cities, self).__init__(cities)
     self.by_name = {}
+    for city in self:
+      self.by_name[city.name] = city
     if (create == 'random') and (N>0):
       for i in range(N):
         self.append(City())
@@ -316,23 +1147,30 @@ class Roads(set):
       roads = []
     super(Roads, self).__init__(roads)
     self.by_cities = {}
-    self.by_names = {}
+    self._by_names = None
     self.other = {}
     self.by_length = None
     for road in self:
       self.update_cities(road)
 
   def update_cities(self, road):
-    """  Update the by_cities and by_names dictionary with this road. """
-    if road == None or self.by_cities == None:
-		print " NONE FOUND"
-		print " self = '%s'" % repr(self)
-		print " by_cities = '%s'" % repr(self.by_cities)
-		print " road = '%s'" % repr(road)
-    self.by_cities[(road[0], road[1])] = road
-    self.by_cities[(road[1], road[0])] = road
-    self.by_names[(road[1].name, road[0].name)] = road
-    self.by_names[(road[0].name, road[1].name)] = road    
+    """  Update the by_cities dictionary with this road. """
+    (city1, city2) = road.ends
+    self.by_cities[(city1, city2)] = road
+    self.by_cities[(city2, city1)] = road
+    self._by_names = None
+
+  @property
+  def by_names(self):
+    """ A dictionary of the roads by (name1, name2),
+        which is only made when it's asked for. """
+    # The LK search adds and removes roads from a Tour all the time,
+    # but only looks them up by city, never by name.
+    if self._by_names == None:
+      self._by_names = {}
+      for ((city1, city2), road) in self.by_cities.iteritems():
+        self._by_names[(city1.name, city2.name)] = road
+    return self._by_names
 
   def update_by_length(self):
     """ If not yet created or invalid after modification,
@@ -353,11 +1191,11 @@ class Roads(set):
   def remove(self, road):
     """ Remove a road from this collection. """
     super(Roads, self).remove(road)
-    del self.by_cities[(road[0], road[1])]
-    del self.by_cities[(road[1], road[0])]
-    del self.by_names[(road[0].name, road[1].name)]
-    del self.by_names[(road[1].name, road[0].name)]
-    self.by_length = None    
+    (city1, city2) = road.ends
+    del self.by_cities[(city1, city2)]
+    del self.by_cities[(city2, city1)]
+    self._by_names = None
+    self.by_length = None
 
   def get(self, city1, city2):
     """ Return the road with the given city endpoints or names. """
@@ -374,6 +1212,75 @@ class Roads(set):
     return str(self.by_length)
 
 
+class RoadCache(object):
+  """ All the roads of a TSP's complete graph, without storing all of 'em.
+      A Road object is only created (and then remembered) the first time
+      it's asked for.
+      >>> tsp = TSP(cities='test6')
+      >>> len(tsp.roads)
+      15
+      >>> str(tsp.roads.get('A', 'B'))
+      'A--B (1.12)'
+      >>> tsp.roads.get('B', 'A') is tsp.roads.get(*tsp.cities[0:2])
+      True
+      >>> len(tsp.roads.by_indices)
+      1
+      >>> tsp.roads.get('B', 'D').key        # i*N + j for B=1, D=3 of N=6
+      9
+      >>> tsp.roads.get('A', 'A') == None
+      True
+  """
+  # With N cities there are N(N-1)/2 roads, but the LK search only
+  # looks at the few shortest from each city plus the ones in the tour.
+
+  def __init__(self, tsp):
+    self.tsp = tsp
+    self.by_indices = {}    # i*N + j with i < j => Road between cities i, j
+
+  def get(self, city1, city2):
+    """ Return the road with the given city endpoints or names. """
+    if isinstance(city1, str) and isinstance(city2, str):
+      (city1, city2) = (self.tsp.cities.get(city1), self.tsp.cities.get(city2))
+    elif not (isinstance(city1, City) and isinstance(city2, City)):
+      raise Exception('illegal argument to RoadCache.get')
+    (i, j) = (city1.index, city2.index)
+    if i == j:
+      return None
+    key = i*len(self.tsp.cities) + j if i < j else \
+          j*len(self.tsp.cities) + i
+    road = self.by_indices.get(key)
+    if road == None:
+      road = Road(city1, city2, key=key)
+      self.by_indices[key] = road
+    return road
+
+  def __len__(self):
+    n = len(self.tsp.cities)
+    return n*(n-1)/2
+
+  def __iter__(self):
+    """ Loop over every road, creating any that don't yet exist. """
+    cities = self.tsp.cities
+    for i in range(len(cities)):
+      for j in range(i+1, len(cities)):
+        yield self.get(cities[i], cities[j])
+
+  def __str__(self):
+    """ as string version is sorted by length and city names """
+    # Only the two shortest and two longest roads are shown,
+    # so find those from the distances without making all the roads.
+    cities = self.tsp.cities
+    (rows, cols) = numpy.triu_indices(len(cities), 1)
+    order = numpy.argsort(self.tsp.distances[rows, cols], kind='mergesort')
+    if len(order) > 4:
+      order = numpy.concatenate((order[:2], order[-2:]))
+    roads = sorted([self.get(cities[rows[k]], cities[cols[k]]) for k in order])
+    names = map(str, roads)
+    if len(self) > 4:
+      names[2:2] = ['...']
+    return "<Roads (%i): %s>" % (len(self), ", ".join(names))
+
+
 class Tour(Roads):
   """ A connected directed graph of roads (edges) and cities (vertices).
 
@@ -471,6 +1378,11 @@ class Tour(Roads):
   # So to do one of these LK modifications, self.last is changed
   # and self.neighbors is modified from city i onwards.
   #
+  # Flipping the whole path end-for-end, as tour2path(road, backward=True)
+  # does, would mean swapping every pair in self.neighbors.  Instead
+  # self.forward is toggled, and while it's False each pair is read
+  # the other way around, as (city[i+1], city[i-1]), like ArrayTour.
+  #
   # The Road objects don't store a direction; they just contain
   # distances, and allow for sorting by length in their Roads container.
   #
@@ -484,10 +1396,15 @@ class Tour(Roads):
   # to implement all this, but it should be good enough.
   #
 
+  construction_neighbors = 10     # candidate roads per city for 'greedy' etc
+
   def __init__(self, tsp, tour):
     """ Inputs: tsp   = a TSP() instance, with cities and roads in place.
                 tour  = 'default'     => tsp.cities, in their default order
                         'random'      => tsp.cities, in a random order
+                        'nearest', 'greedy', 'spacefill' or 'christofides'
+                                      => built by that tour_constructions
+                                         heuristic, much shorter than random
                         [city1, city2, ...] => that sequence of cities
                         [name1, name2, ...] => tsp.cities with these names
     """
@@ -496,19 +1413,10 @@ class Tour(Roads):
     #    closed loop iff len(self) == len(self.cities)
     #    self.neighbors[city[i]] = (city[i-1], city[i+1]) defines the sequence
     #    self.tsp.roads.get(cityX, cityY) = the road between any two cities
-    #    city.roads.by_length = sorted list of all tsp roads for given city
+    #    self.tsp.candidate_roads(city, m) = list of m roads to search
     #
     self._str_alphaorder = False         # if true, normalize print city order
-    if isinstance(tour, str):
-      cities = tsp.cities                # 'default'
-      if tour == 'random':
-        random.shuffle(cities)           # 'random'
-    elif isinstance(tour[0], City):      # [city1, city2, ...]
-      cities = Cities(tour)         
-    elif isinstance(tour[0], str):       # [name1, name2, ...]
-      cities = Cities(map(lambda x: tsp.cities.by_name[x], tour))
-    else:
-      raise Exception('Illegal tour argument in Tour initialization')
+    cities = self.tour_cities(tsp, tour)
     self.tsp = tsp
     self.cities = cities
     self.max_search_roads = tsp.lk_search_roads_per_city
@@ -516,21 +1424,90 @@ class Tour(Roads):
     roads = [tsp.roads.get(self.cities[i], self.cities[(i+1) % n]) for i in range(n)]
     super(Tour, self).__init__(roads)
     self.first = self.last = None
+    (self._backward, self._path_mods) = (False, [])
+    self.forward = True
     self.neighbors = {}
     for i in range(n):
       self.neighbors[cities[i]] = (cities[i-1], cities[(i+1)%n])
     self.length = sum([road.length for road in self])
 
+  def tour_cities(self, tsp, tour):
+    """ Return the Cities for the tour argument of __init__.
+        >>> tsp = TSP(cities='test6')
+        >>> str(Tour(tsp, 'greedy'))
+        '<Tour (6 roads, length 7.17): A - B - C - D - E - F - A>'
+        >>> tsp = TSP(cities=300)
+        >>> random_length = Tour(tsp, 'random').length
+        >>> [Tour(tsp, name).length < random_length / 3 for name in
+        ...  ('nearest', 'greedy', 'spacefill', 'christofides')]
+        [True, True, True, True]
+    """
+    if isinstance(tour, str):
+      cities = tsp.cities                # 'default'
+      if tour == 'random':
+        cities = Cities(cities)          # 'random'
+        random.shuffle(cities)           #   (tsp.cities[i].index must be i)
+      elif tour != 'default':            # 'greedy' etc
+        construct = tour_constructions[tour]
+        k = min(Tour.construction_neighbors, len(cities) - 1)
+        order = construct(tsp.xy, tsp.neighbor_indices(k))
+        cities = Cities([cities[i] for i in order])
+    elif isinstance(tour[0], City):      # [city1, city2, ...]
+      cities = Cities(tour)         
+    elif isinstance(tour[0], str):       # [name1, name2, ...]
+      cities = Cities(map(lambda x: tsp.cities.by_name[x], tour))
+    else:
+      raise Exception('Illegal tour argument in Tour initialization')
+    return cities
+
+  # The sequence of cities in self.cities isn't modified during the LK
+  # modifications, and revert() undoes them (as logged in self._path_mods)
+  # and then tour2path, so it's the same again afterwards.  close() keeps
+  # them instead, and the new self.cities are only found if asked for.
+  # Either way, that's O(work done on the path) rather than O(N).
+
+  def get_cities(self):
+    if self._cities == None:
+      self._cities = self.loop_cities()
+    return self._cities
+
+  def set_cities(self, cities):
+    self._cities = cities
+
+  cities = property(get_cities, set_cities)
+
+  def loop_cities(self):
+    """ Return the cities around the closed tour, from self._start. """
+    cities = Cities([self._start])
+    city = self.next_city(self._start)
+    while city != self._start:
+      cities.append(city)
+      city = self.next_city(city)
+    return cities
+
+  def join_ends(self):
+    """ Put back the road between the ends of the path. """
+    self.add(self.tsp.roads.get(self.first, self.last))
+    self.first = self.last = None
+
   def revert(self):
     """ Reset back to the original closed tour. """
-    # The sequence of cities in self.cities isn't modified
-    # during the LK modifications.
-    self.__init__(self.tsp, self.cities)
+    if self.is_tour():
+      return
+    while self._path_mods:
+      self.unmodify(*self._path_mods[-1])
+    self.join_ends()
+    if self._backward:
+      self.flip_direction()
 
   def close(self):
     """ Convert from an open path to a closed tour,
         keeping the city sequence generated from the LK modifications. """
-    self.__init__(self.tsp, self.city_sequence())
+    if self.is_tour():
+      return
+    start = self.first
+    self.join_ends()
+    (self._cities, self._start, self._path_mods) = (None, start, [])
 
   def find_lk_mods(self, added=None, deleted=None):
     """ Return viable L.K. modifications as described in the ascii art above,
@@ -547,6 +1524,7 @@ class Tour(Roads):
           5. road_to_delete is not in added
                i.e. don't backtrack within one L.K. K-Opt iteration
           6. road_to_add is not in 'deleted'  (in some versions of L.K.)
+          7. road_to_delete is not a backbone road fixed by the TSP
         There are at most N-2 of these (or at most M=5 if using that speedup),
         and likely much fewer.
     """
@@ -556,15 +1534,20 @@ class Tour(Roads):
       deleted = set()
     mods = []
     cityN = self.last
+    fixed = self.tsp._lk_fixed
     # Of roads from cityN, look at the at shortest, most likely roads first.
-    for road_add in cityN.roads.by_length[:self.max_search_roads]:         # 1
+    for road_add in self.tsp.candidate_roads(cityN, self.max_search_roads):# 1
       city_insert = road_add.other(cityN)
       if city_insert == self.prev_city(cityN): continue                    # 2
       road_delete = self.get(city_insert, self.next_city(city_insert))     # 3
       if road_add.length >= road_delete.length: continue                   # 4
       if road_delete in added: continue                                    # 5
       if road_add in deleted: continue                                     # 6
+      if road_delete in fixed: continue                                    # 7
       mods.append((city_insert, road_add, road_delete))
+    stats = self.tsp.lk_stats
+    stats.mods_calls += 1
+    stats.mods_found += len(mods)
     return mods
     
   def tour_length(self):
@@ -580,8 +1563,10 @@ class Tour(Roads):
         or if it will be once its filled in. """
     # So either road[0] => road[1]   i.e. next(0) = 1
     # or road[-1] => road[0] = None / gap / None => road[1] => road[2] .
-    return self.next_city(road[0]) == road[1] or \
-           self.next_city(road[0]) == None == self.prev_city(road[1])
+    (city1, city2) = road.ends
+    after1 = self.next_city(city1)
+    return after1 is city2 or \
+           after1 is None is self.prev_city(city2)
 
   def is_tour(self):
     """ Return true if in original, Tour state,
@@ -593,24 +1578,29 @@ class Tour(Roads):
     """ Convert a closed tour into an LK path by removing a road.
         If backward is true, also flip the direction of the path. """
     assert self.is_tour()
+    (self._backward, self._path_mods) = (backward, [])
     if backward:
       self.flip_direction()
     if self.is_forward(road):
-      (self.first, self.last) = (road[1], road[0])
+      (self.last, self.first) = road.ends
     else:
-      (self.first, self.last) = (road[0], road[1])
+      (self.first, self.last) = road.ends
     self.remove(road)
 
   def replace_neighbors(self, road, (a, b)):
     """ Replace neighbors of road ends with new neighbors (a,b) """
-    (before0, after0) = self.neighbors[road[0]]
-    (before1, after1) = self.neighbors[road[1]]
-    if self.is_forward(road):
-      self.neighbors[road[0]] = (before0, b)
-      self.neighbors[road[1]] = (a, after1)
+    (city0, city1) = road.ends
+    if not self.is_forward(road):
+      (city0, city1, a, b) = (city1, city0, b, a)
+    # So now city0 => city1; its next city becomes b, and city1's prev a.
+    (before0, after0) = self.neighbors[city0]
+    (before1, after1) = self.neighbors[city1]
+    if self.forward:
+      self.neighbors[city0] = (before0, b)
+      self.neighbors[city1] = (a, after1)
     else:
-      self.neighbors[road[1]] = (before1, a)
-      self.neighbors[road[0]] = (b, after0)
+      self.neighbors[city0] = (b, after0)
+      self.neighbors[city1] = (before1, a)
 
   def add(self, road):
     """ Add a road. """
@@ -630,18 +1620,31 @@ class Tour(Roads):
     self.neighbors[city] = (after, before)
     
   def flip_direction(self, cityA=None, cityB=None):
+    """ Reverse the path from cityA through cityB, or the whole thing
+        if they aren't given, which just toggles self.forward.
+        >>> tsp = TSP(cities=100, tour='default')
+        >>> (tour, stats) = (tsp.tour, tsp.lk_stats)
+        >>> tour.tour2path(tour.get(tsp.cities[5], tsp.cities[6]), backward=True)
+        >>> (tour.first.index, tour.last.index, tour.next_city(tour.first).index)
+        (5, 6, 4)
+        >>> tour.revert()
+        >>> (stats.flips, tour.forward, tour.city_sequence() == tsp.cities)
+        (0, True, True)
+    """
+    count = 0
     if cityA:
       city = cityA
       while city:
         next_city = self.next_city(city)
         self.flip1city(city)
+        count += 1
         if city == cityB:
           break
         city = next_city
     else:
-      for city in self.cities:
-        self.flip1city(city)
+      self.forward = not self.forward
       (self.first, self.last) = (self.last, self.first)
+    self.tsp.lk_stats.flips += count
 
   def modify(self, city_insert, road_add, road_delete):
     """ Do LK path modification """
@@ -669,6 +1672,7 @@ class Tour(Roads):
     self.flip_direction(iPlus1, cityN)
     self.add(road_add)
     self.last = iPlus1
+    self._path_mods.append((city_insert, road_add, road_delete))
 
   def unmodify(self, city_insert, road_add, road_delete):
     """ Undo LK path modification """
@@ -682,12 +1686,13 @@ class Tour(Roads):
     self.flip_direction(cityN, iPlus1)
     self.add(road_delete)
     self.last = cityN
+    self._path_mods.pop()
 
   def next_city(self, city):
-    return self.neighbors[city][1]
+    return self.neighbors[city][self.forward]     # i.e. [1] if forward
 
   def prev_city(self, city):
-    return self.neighbors[city][0]
+    return self.neighbors[city][not self.forward]
 
   def city_sequence(self, alphaorder=False):
     """ Return the cities along the path from first to last,
@@ -708,13 +1713,7 @@ class Tour(Roads):
     if not self.first and not self.last:
       cities =  self.cities
     else:
-      cities = Cities()
-      city = self.first
-      while True:
-        cities.append(city)
-        if city == self.last:
-          break
-        city = self.next_city(city)
+      cities = self.path_cities()
     if alphaorder and self.is_tour():
       city_first = min(map(lambda x: (x.name, x), cities))[1]
       index_first = cities.index(city_first)
@@ -723,13 +1722,24 @@ class Tour(Roads):
         cities[1:] = list(reversed(cities[1:]))
     return cities
 
+  def path_cities(self):
+    """ Return the cities along the path from first to last. """
+    cities = Cities()
+    city = self.first
+    while True:
+      cities.append(city)
+      if city == self.last:
+        break
+      city = self.next_city(city)
+    return cities
+
   def __str__(self):
     city_sequence = self.city_sequence(self._str_alphaorder)
     names = [c.name for c in city_sequence]
     if len(names) > 8:
       names[3:-3] = ['...']
     city_string = " - ".join(names)
-    if len(self.cities) == len(self):
+    if self.is_tour():
       city_string += " - " + city_sequence[0].name
       return "<Tour (%i roads, length %4.2f): %s>" % \
              (len(self), self.length, city_string)
@@ -738,9 +1748,259 @@ class Tour(Roads):
              (len(self), self.length, self.tour_length(), city_string)
 
 
-class RestartLK(Exception):
-  """ A generic custom exception """
-  pass
+class ArrayTour(Tour):
+  """ The same closed tour or LK path as a Tour, but with the city order
+      kept in an array of city indices rather than a dictionary of roads.
+      Its modify() and unmodify() only reverse the shorter of the two parts
+      of the tour, so on long tours they don't need to touch most cities.
+
+      >>> tour = ArrayTour(TSP(cities='test6'), ('A', 'D', 'C', 'E', 'B', 'F'))
+      >>> str(tour)
+      '<Tour (6 roads, length 10.75): A - D - C - E - B - F - A>'
+      >>> tour.tour2path(tour.get('A', 'F'), backward=True); str(tour)
+      '<Path (5 roads, length 9.24, tour 10.75): F - B - E - C - D - A>'
+      >>> tour.revert(); tour.tour2path(tour.get('A', 'F')); str(tour)
+      '<Path (5 roads, length 9.24, tour 10.75): A - D - C - E - B - F>'
+      >>> mods = tour.find_lk_mods()
+      >>> tour.modify(*mods[0]); str(tour)    # break E-B, add E-F :
+      '<Path (5 roads, length 8.64, tour 9.76): A - D - C - E - F - B>'
+      >>> tour.order, tour.forward            # B - F was reversed
+      ([0, 3, 2, 4, 5, 1], True)
+      >>> tour.unmodify(*mods[0])
+      >>> tour.modify(*mods[1]); str(tour)    # break A-D, add F-A :
+      '<Path (5 roads, length 8.17, tour 10.75): A - F - B - E - C - D>'
+      >>> tour.order, tour.forward            # the rest (just A) was reversed
+      ([0, 3, 2, 4, 1, 5], False)
+      >>> tour.close(); str(tour)
+      '<Tour (6 roads, length 10.75): A - F - B - E - C - D - A>'
+  """
+  # The tour is stored as
+  #
+  #   self.order[p] = index of the p'th city around the tour
+  #   self.position[city.index] = p
+  #   self.forward = True if the path (or tour) runs in the direction
+  #                  of increasing p, False if it runs the other way.
+  #
+  # with tsp.cities[i] the city whose index is i, and with the p's
+  # wrapping around modulo n.  As in Tour, the LK path has
+  # self.first and self.last at either end of the one missing road.
+  #
+  # Reversing a stretch of the path, as in flip_direction(cityA, cityB),
+  # leaves the same cities connected in the same order whether that
+  # stretch or the rest of the tour is reversed in self.order, as long
+  # as self.forward is toggled in the second case.  So the shorter one
+  # is reversed, and each LK modification moves at most n/2 cities.
+  #
+  # Since the roads aren't stored, the underlying Roads set is empty;
+  # so loop over an ArrayTour (e.g. list(tour)) to get its roads
+  # rather than passing it to set() or Roads().
+
+  def __init__(self, tsp, tour):
+    """ Inputs are the same as for Tour. """
+    self._str_alphaorder = False
+    self.tsp = tsp
+    self.cities = self.tour_cities(tsp, tour)
+    self.max_search_roads = tsp.lk_search_roads_per_city
+    self.order = [city.index for city in self.cities]
+    self.position = [None] * len(tsp.cities)
+    for (p, i) in enumerate(self.order):
+      self.position[i] = p
+    self.forward = True
+    self.first = self.last = None
+    (self._backward, self._path_mods) = (False, [])
+    xy = tsp.xy[self.order]
+    delta = xy - numpy.roll(xy, -1, axis=0)
+    self.length = float(numpy.sqrt((delta*delta).sum(axis=1)).sum())
+
+  def __len__(self):
+    """ Return number of roads. """
+    if self.is_tour():
+      return len(self.order)
+    else:
+      return len(self.order) - 1
+
+  def __iter__(self):
+    """ Loop over the roads, in order from self.first if a path. """
+    cities = self.city_sequence()
+    for i in range(len(self)):
+      yield self.tsp.roads.get(cities[i], cities[(i+1) % len(cities)])
+
+  def __contains__(self, road):
+    return self.get(*road.ends) is not None
+
+  def get(self, city1, city2):
+    """ Return the road with the given city endpoints or names,
+        or None if it isn't in the tour or path. """
+    if isinstance(city1, str) and isinstance(city2, str):
+      (city1, city2) = (self.tsp.cities.get(city1), self.tsp.cities.get(city2))
+    if self.next_city(city1) is city2 or self.prev_city(city1) is city2:
+      return self.tsp.roads.get(city1, city2)
+    else:
+      return None
+
+  def next_city(self, city):
+    if city is self.last:
+      return None
+    p = self.position[city.index] + (1 if self.forward else -1)
+    return self.tsp.cities[self.order[p % len(self.order)]]
+
+  def prev_city(self, city):
+    if city is self.first:
+      return None
+    p = self.position[city.index] - (1 if self.forward else -1)
+    return self.tsp.cities[self.order[p % len(self.order)]]
+
+  def path_cities(self):
+    """ Return the cities along the path from first to last. """
+    return self.cities_from(self.first)
+
+  def loop_cities(self):
+    """ Return the cities around the closed tour, from self._start. """
+    return self.cities_from(self._start)
+
+  def cities_from(self, city):
+    """ Return all the cities in order, starting with this one. """
+    p = self.position[city.index]
+    if self.forward:
+      indices = self.order[p:] + self.order[:p]
+    else:
+      indices = self.order[p::-1] + self.order[:p:-1]
+    return Cities([self.tsp.cities[i] for i in indices])
+
+  def join_ends(self):
+    """ Put back the road between the ends of the path. """
+    self.length += self.tsp.roads.get(self.first, self.last).length
+    self.first = self.last = None
+
+  def tour2path(self, road, backward=False):
+    """ Convert a closed tour into an LK path by removing a road.
+        If backward is true, also flip the direction of the path. """
+    assert self.is_tour()
+    (self._backward, self._path_mods) = (backward, [])
+    if backward:
+      self.forward = not self.forward
+    if self.is_forward(road):
+      (self.last, self.first) = road.ends
+    else:
+      (self.first, self.last) = road.ends
+    self.length -= road.length
+
+  def reverse_positions(self, p, q):
+    """ Reverse self.order from position p up through position q,
+        wrapping around if q < p, or the rest of it if that's shorter. """
+    (order, position, n) = (self.order, self.position, len(self.order))
+    count = (q - p) % n + 1
+    if 2 * count > n:
+      (p, q, count) = (q + 1, p - 1, n - count)
+      self.forward = not self.forward
+    self.tsp.lk_stats.flips += count
+    for k in range(count / 2):
+      (p, q) = (p % n, q % n)
+      (i, j) = (order[p], order[q])
+      (order[p], order[q]) = (j, i)
+      (position[j], position[i]) = (p, q)
+      (p, q) = (p + 1, q - 1)
+
+  def flip_direction(self, cityA=None, cityB=None):
+    """ Reverse the path from cityA through cityB,
+        or the whole thing if they aren't given. """
+    if cityA:
+      (p, q) = (self.position[cityA.index], self.position[cityB.index])
+      if self.forward:
+        self.reverse_positions(p, q)
+      else:
+        self.reverse_positions(q, p)
+    else:
+      self.forward = not self.forward
+      (self.first, self.last) = (self.last, self.first)
+
+  def modify(self, city_insert, road_add, road_delete):
+    """ Do LK path modification """
+    # See the pictures in Tour.
+    iPlus1 = road_delete.other(city_insert)
+    cityN = self.last
+    if not road_delete in self:
+      raise Exception("Oops - tried to remove %s from ArrayTour" % \
+                      str(road_delete))
+    self.flip_direction(iPlus1, cityN)
+    self.length += road_add.length - road_delete.length
+    self.last = iPlus1
+    self._path_mods.append((city_insert, road_add, road_delete))
+
+  def unmodify(self, city_insert, road_add, road_delete):
+    """ Undo LK path modification """
+    iPlus1 = self.last
+    cityN = road_add.other(city_insert)
+    if not road_add in self:
+      raise Exception("Oops - tried to remove %s from ArrayTour" % \
+                      str(road_add))
+    self.flip_direction(cityN, iPlus1)
+    self.length += road_delete.length - road_add.length
+    self.last = cityN
+    self._path_mods.pop()
+
+
+class LKStats(object):
+  """ Counts of the work done by the LK search, kept by each TSP as
+      tsp.lk_stats and zeroed by LK() and chained_LK().  These are
+      cheap enough to leave on, unlike a profiler, and show where
+      the time is going in the hot paths.
+      >>> tsp = TSP(cities='test6', tour=('A', 'D', 'C', 'E', 'B', 'F'))
+      >>> tsp.LK()
+      >>> stats = tsp.lk_stats
+      >>> (stats.starts > 0, stats.mods_calls == stats.nodes)
+      (True, True)
+      >>> sum(stats.depths) == stats.nodes
+      True
+      >>> twice = LKStats(); twice.add(stats); twice.add(stats)
+      >>> twice.as_dict()['nodes'] == 2 * stats.nodes
+      True
+      >>> print LKStats()
+      <LKStats starts=0 nodes=0 node_limit_hits=0 mods_calls=0 mods_found=0 mods_tried=0 flips=0 accepted=0 kicks=0 kicks_improved=0 depths=[]>
+  """
+
+  counters = ('starts',           # path searches started by tour_improve
+              'nodes',            # calls to path_search
+              'node_limit_hits',  # starts cut short by lk_max_nodes
+              'mods_calls',       # calls to find_lk_mods
+              'mods_found',       #   and the modifications they returned
+              'mods_tried',       # modifications made by path_search
+              'flips',            # cities reversed by flip_direction
+              'accepted',         # better tours taken mid-search
+              'kicks',            # double bridges tried by chained_LK
+              'kicks_improved')   #   and the ones that gave a shorter tour
+
+  def __init__(self):
+    for name in self.counters:
+      setattr(self, name, 0)
+    self.depths = []      # depths[d] = calls to path_search at depth d
+
+  def count_depth(self, depth):
+    """ Count a call to path_search at this recursion depth. """
+    while len(self.depths) <= depth:
+      self.depths.append(0)
+    self.depths[depth] += 1
+
+  def add(self, other):
+    """ Add the counts from another LKStats to these. """
+    for name in self.counters:
+      setattr(self, name, getattr(self, name) + getattr(other, name))
+    for (depth, count) in enumerate(other.depths):
+      if depth < len(self.depths):
+        self.depths[depth] += count
+      else:
+        self.depths.append(count)
+
+  def as_dict(self):
+    """ Return the counts as a dictionary. """
+    result = dict([(name, getattr(self, name)) for name in self.counters])
+    result['depths'] = list(self.depths)
+    return result
+
+  def __str__(self):
+    return '<LKStats ' + \
+           ' '.join(['%s=%s' % (name, getattr(self, name))
+                     for name in self.counters + ('depths',)]) + '>'
 
 
 class TSP(object):
@@ -756,7 +2016,7 @@ class TSP(object):
       >>> tsp.print_brute_force() 
       -- brute force analysis of 6 cities with 60 distinct tours --
       best is <Tour (6 roads, length 7.17): A - B - C - D - E - F - A>
-      worst is <Tour (6 roads, length 11.88): A - C - E - B - F - D - A>
+      worst is <Tour (6 roads, length 12.42): A - D - B - F - C - E - A>
       
       >>> tsp.lk_verbose = False
       >>> str(tsp.tour)
@@ -768,6 +2028,13 @@ class TSP(object):
       >>> randomTSP = TSP(cities=10, tour='random')
       >>> len(randomTSP.tour)
       10
+
+      >>> tsp = TSP(cities='test6', tour=('A', 'D', 'C', 'E', 'B', 'F'),
+      ...           tour_engine='array')
+      >>> tsp.lk_dont_look_bits = True
+      >>> tsp.LK()
+      >>> "%.2f" % tsp.tour.length
+      '7.17'
   """
 
   #    The LK search wasn't behaving deterministically:
@@ -785,17 +2052,40 @@ class TSP(object):
   #    versions); and I'm not sure if this is still true.
   #    And it may not matter anway ... just didn't understand it.
 
-  def __init__(self, cities=None, tour=None):
+  def __init__(self, cities=None, tour=None, tour_engine='linked'):
     """ Inputs:
-            cities = None | [city1, city2, ...] | 'test6'
+            cities = None | [city1, city2, ...] | 'test6' | N
+                     | an (N,2) numpy array of (x,y) coordinates
             tour = None | 'random' | 'default' | [city1, ..] | ['name1', ..]
+                   | 'nearest' | 'greedy' | 'spacefill' | 'christofides'
+            tour_engine = 'linked' => Tour, a dictionary of neighbors
+                          'array'  => ArrayTour, faster for many cities
     """
+    self.tour_class = {'linked': Tour, 'array': ArrayTour}[tour_engine]
 
     # ---- Lin-Kernighan search parameters ----
     self.lk_verbose               = False
     self.lk_depth_limit           = None   # None => until no candidates
     self.lk_restart_better_tours  = True   # i.e. Johnson; False in LK paper
     self.lk_search_roads_per_city = 10     # -1 => all; 5 in LK paper
+    self.lk_candidates            = 'nearest'  # or 'alpha' => the roads
+                                           #   searched from each city are
+                                           #   by alpha_nearest(), not length
+    self.lk_dont_look_bits        = False  # True => search only from cities
+                                           #   near recent improvements
+    self.lk_breadth               = None   # None => try all mods; or e.g.
+                                           #   (5, 3, 1) => try 5 at depth 0,
+                                           #   3 at depth 1, 1 at deeper ones
+    self.lk_max_nodes             = None   # None => no limit on path_search
+                                           #   calls from each starting path
+    self.lk_kick_span             = 50     # chained_LK double bridges are
+                                           #   within this many tour cities
+    self.lk_backbone              = None   # None => no fixed roads; or e.g.
+                                           #   0.9 => LK(n_tries) trials keep
+                                           #   the roads in 90% of the tours
+    self.lk_backbone_after        = 3      #   once there are this many
+    # ---- Lin-Kernighan search counters (an LKStats), reset by LK() ----
+    self.reset_lk_counters()
     # Other possible parameters: 
     #   (L.K. paper uses both of these following constraints;
     #    Johnson uses only the first (constrain_added).
@@ -805,6 +2095,8 @@ class TSP(object):
 
     if type(cities)==int:
       self.cities = Cities(create='random', N=cities)
+    elif isinstance(cities, numpy.ndarray):
+      self.cities = Cities([City(None, x, y) for (x, y) in cities.tolist()])
     elif cities == 'test6':
       self.cities = Cities(create='test6')
     elif cities:
@@ -813,10 +2105,185 @@ class TSP(object):
       self.cities = Cities()
     self.init_TSP()
     if tour:
-      self.tour = Tour(self, tour)
+      self.tour = self.new_tour(tour)
     else:
       self.tour = None
 
+  def shared_arrays(self):
+    """ Move the coordinates, the nearest neighbor and candidate lists and
+        (if it's been built) the distance matrix into shared memory, and return
+        what TSP.from_shared() needs to make a TSP that uses 'em.
+        >>> tsp = TSP(cities='test6')
+        >>> tsp2 = TSP.from_shared(tsp.shared_arrays())
+        >>> tsp2.neighbor_indices(2) is tsp.neighbor_indices(2)
+        False
+        >>> (tsp2.neighbor_indices(2) == tsp.neighbor_indices(2)).all()
+        True
+        >>> str(tsp2.cities)
+        '<Cities (6): A, B, ..., E, F>'
+
+        Arrays that are already shared aren't copied again.
+        >>> shared = tsp.shared_arrays()
+        >>> [tsp.shared_arrays()[key] is shared[key] for key in ('xy', 'neighbors')]
+        [True, True]
+    """
+    k = self.lk_search_roads_per_city
+    self.candidate_indices(k if k >= 0 else len(self.cities) - 1)
+    self.xy = shared_array(self.xy)
+    self._neighbors = shared_array(self._neighbors)
+    if self._candidates is not None:
+      self._candidates = shared_array(self._candidates)
+    if self._distances is not None:
+      self._distances = shared_array(self._distances)
+    settings = self.lk_settings()
+    return {'xy': self.xy, 'neighbors': self._neighbors,
+            'candidates': self._candidates,
+            'distances': self._distances, 'settings': settings,
+            'names': [city.name for city in self.cities]}
+
+  def lk_settings(self):
+    """ Return a dictionary of the lk_ search parameters and counters
+        (and the tour_class), which vars(tsp).update() puts back. """
+    return dict([(key, value) for (key, value) in vars(self).items()
+                 if key.startswith('lk_') or key == 'tour_class'])
+
+  @classmethod
+  def from_shared(cls, shared):
+    """ Return a TSP built around the arrays from shared_arrays(). """
+    # Only the City objects are new; the arrays aren't copied,
+    # so this takes O(N) time and the O(N k) or O(N**2) data is shared.
+    cities = [City(name, x, y)
+              for (name, (x, y)) in zip(shared['names'], shared['xy'].tolist())]
+    tsp = cls(cities=cities)
+    vars(tsp).update(shared['settings'])
+    tsp.xy = shared['xy']
+    tsp._neighbors = shared['neighbors']
+    tsp._candidates = shared['candidates']
+    tsp._distances = shared['distances']
+    return tsp
+
+  @classmethod
+  def from_file(cls, filename, tour=None, tour_engine='linked'):
+    """ Return a TSP of the cities in a TSPLIB .tsp file or a text file
+        of 'x y' lines, loaded by tsplib.read_instance().  The TSPLIB
+        header and coordinates are kept as self.header and self.coords,
+        for tsplib.tsplib_length(tsp.header, tsp.coords, tour).
+        >>> import tempfile
+        >>> f = tempfile.NamedTemporaryFile(suffix='.tsp')
+        >>> f.write('DIMENSION: 3\\nEDGE_WEIGHT_TYPE: ATT\\n'
+        ...         'NODE_COORD_SECTION\\n1 0 0\\n2 30 40\\n3 0 40\\nEOF\\n')
+        >>> f.flush()
+        >>> tsp = TSP.from_file(f.name, tour='default')
+        >>> ("%.2f" % tsp.tour_length(),
+        ...  tsplib.tsplib_length(tsp.header, tsp.coords, range(3)))
+        ('37.95', 39)
+    """
+    (header, coords) = tsplib.read_instance(filename)
+    tsp = cls(cities=tsplib.planar_coordinates(header, coords),
+              tour=tour, tour_engine=tour_engine)
+    (tsp.header, tsp.coords) = (header, coords)
+    return tsp
+
+  def save_cache(self, directory):
+    """ Save what took time to work out for these cities into
+        directory/<instance_key>/ : the coordinates, nearest neighbor
+        and candidate lists, lower bound penalties, and the tour,
+        if it's the shortest saved so far.  Return that path.
+        Each is a .npy file, which load_cache() memory-maps back.
+    """
+    path = os.path.join(directory, instance_key(self.xy))
+    if not os.path.isdir(path):
+      try:
+        os.makedirs(path)
+      except OSError:
+        if not os.path.isdir(path):
+          raise
+    save_array(path, 'xy', self.xy)
+    if self._neighbors is not None:
+      save_array(path, 'neighbors', self._neighbors)
+    if self._candidates is not None:
+      save_array(path, 'candidates', self._candidates)
+    if self._lower_bound != None:
+      (bound, iterations, pi) = self._lower_bound
+      save_array(path, 'pi', pi)
+      save_array(path, 'bound', [bound, iterations])
+    if self.tour:
+      tour = [city.index for city in self.tour.city_sequence()]
+      saved = self.cached_arrays(path).get('tour')
+      if saved is None or self.order_length(tour) < self.order_length(saved):
+        save_array(path, 'tour', tour)
+    return path
+
+  def load_cache(self, directory):
+    """ Use whatever save_cache() has put in directory for these cities,
+        including its tour if that's shorter than self.tour (or there
+        isn't one).  Return True if there was anything there.
+        >>> import tempfile, shutil
+        >>> directory = tempfile.mkdtemp()
+        >>> tsp = TSP(cities=30, tour='greedy')
+        >>> tsp.lk_candidates = 'alpha'
+        >>> (candidates, bound) = (tsp.candidate_indices(5), tsp.lower_bound())
+        >>> path = tsp.save_cache(directory)
+        >>> tsp2 = TSP(cities=[City(c.name, c.x, c.y) for c in tsp.cities])
+        >>> tsp2.lk_candidates = 'alpha'
+        >>> tsp2.load_cache(directory)
+        True
+        >>> "%.6f" % tsp2.tour_length() == "%.6f" % tsp.tour_length()
+        True
+        >>> (tsp2.candidate_indices(5) == candidates).all()
+        True
+        >>> (tsp2.lower_bound() == bound, isinstance(tsp2._neighbors, numpy.memmap))
+        (True, True)
+        >>> shutil.rmtree(directory)
+    """
+    path = os.path.join(directory, instance_key(self.xy))
+    arrays = self.cached_arrays(path)
+    if 'xy' not in arrays or not numpy.array_equal(arrays['xy'], self.xy):
+      return False
+    if 'neighbors' in arrays:
+      self._neighbors = arrays['neighbors']
+      self._nearest_roads = {}
+    if 'candidates' in arrays:
+      self._candidates = arrays['candidates']
+      self._candidate_roads = {}
+    if 'bound' in arrays and 'pi' in arrays:
+      (bound, iterations) = arrays['bound']
+      self._lower_bound = (bound, int(iterations), arrays['pi'])
+    tour = arrays.get('tour')
+    if tour is not None and (not self.tour or
+                             self.order_length(tour) < self.tour.length):
+      self.tour = self.new_tour([self.cities[i] for i in tour])
+    return True
+
+  def cached_arrays(self, path):
+    """ Return a dictionary of the memory-mapped arrays
+        that save_cache() has put in the path directory. """
+    arrays = {}
+    if os.path.isdir(path):
+      for filename in os.listdir(path):
+        if filename.endswith('.npy'):
+          arrays[filename[:-4]] = numpy.load(os.path.join(path, filename),
+                                             mmap_mode='r')
+    return arrays
+
+  def order_length(self, order):
+    """ Return the length of the tour through the cities with
+        this sequence of indices.
+        >>> "%.2f" % TSP(cities='test6').order_length([0, 3, 2, 4, 1, 5])
+        '10.75'
+    """
+    delta = self.xy[order] - self.xy[numpy.roll(order, -1)]
+    return numpy.sqrt((delta * delta).sum(axis=1)).sum()
+
+  def new_tour(self, tour):
+    """ Return a Tour or ArrayTour (depending on tour_engine)
+        of these cities; see Tour() for the tour argument.
+        >>> tsp = TSP(cities='test6', tour_engine='array')
+        >>> str(tsp.new_tour('default'))
+        '<Tour (6 roads, length 7.17): A - B - C - D - E - F - A>'
+    """
+    return self.tour_class(self, tour)
+
   def tour_length(self):
     """ Return length of tour. """
     return self.tour.tour_length()
@@ -828,8 +2295,43 @@ class TSP(object):
     return result + " >"
 
   def randomize_tour(self):
-    """ reorder current cities into a random tour """
-    self.tour = Tour(self, 'random')
+    """ reorder current cities into a random tour ;
+        or if there are fixed backbone roads, a backbone_tour() """
+    if self._lk_fixed:
+      self.tour = self.new_tour(self.backbone_tour())
+    else:
+      self.tour = self.new_tour('random')
+
+  def backbone_tour(self):
+    """ Return a random tour (a list of cities) with all of the fixed
+        backbone roads from fix_backbone() : the paths they make are
+        joined nearest end first, as in greedy_tour, from a random end.
+        >>> tsp = TSP(cities='test6')
+        >>> tsp._lk_fixed = set([tsp.roads.get('A', 'B'), tsp.roads.get('B', 'C'),
+        ...                      tsp.roads.get('E', 'F')])
+        >>> tour = tsp.new_tour(tsp.backbone_tour())
+        >>> (len(tour), tsp._lk_fixed <= set(tour))
+        (6, True)
+    """
+    # A city has at most two of 'em unless lk_backbone is 2/3 or less,
+    # and then any more are left out, as is the last road of any loop.
+    n = len(self.cities)
+    adjacent = [[] for i in range(n)]
+    fragment = range(n)             # union-find, as in greedy_tour
+    def root(i):
+      while fragment[i] != i:
+        fragment[i] = fragment[fragment[i]]
+        i = fragment[i]
+      return i
+    for road in sorted(self._lk_fixed, key=lambda road: road.key):
+      (a, b) = (road.ends[0].index, road.ends[1].index)
+      if len(adjacent[a]) < 2 and len(adjacent[b]) < 2 and root(a) != root(b):
+        fragment[root(a)] = root(b)
+        adjacent[a].append(b)
+        adjacent[b].append(a)
+    ends = [i for i in range(n) if len(adjacent[i]) < 2]
+    order = join_fragments(self.xy, adjacent, random.choice(ends))
+    return [self.cities[i] for i in order]
 
   def graph(self, filename=None, all_lines=True, scale=100.0):
     """ Return SVG graph string of TSP.
@@ -860,7 +2362,7 @@ class TSP(object):
     # There are (N-1)!/2 closed tours of N cities; with N=6 this is 60.
     # For the test6 case this analysis gives :
     #   best is ['A', 'B', 'C', 'D', 'E', 'F'] with length = 7.1708
-    #   worst is ['A', 'C', 'E', 'B', 'F', 'D'] with length = 11.8806
+    #   worst is ['A', 'D', 'B', 'F', 'C', 'E'] with length = 12.4225
     #
     cities = self.cities
     print "-- brute force analysis of %i cities with %i distinct tours --" \
@@ -875,7 +2377,7 @@ class TSP(object):
     perms = proper_permutations(names)
     lengths_perms = []
     for p in perms:
-      t = Tour(self, p)
+      t = self.new_tour(p)
       lengths_perms.append((t.tour_length(), t))
 
     best = min(lengths_perms)
@@ -886,34 +2388,237 @@ class TSP(object):
     print "best is %s" % str(best[1])
     print "worst is %s" % str(worst[1])
 
+  def exact_tour(self, processes=None):
+    """ Return (length, Cities) of a shortest tour, found with held_karp().
+        That's practical up to about 20 cities, where it takes seconds
+        rather than the hours of print_brute_force().
+        See held_karp() for processes.
+        >>> tsp = TSP(cities='test6')
+        >>> (length, cities) = tsp.exact_tour()
+        >>> ("%.2f" % length, [city.name for city in cities])
+        ('7.17', ['A', 'F', 'E', 'D', 'C', 'B'])
+        >>> tsp = TSP(cities=8)
+        >>> brute_force = min([tsp.new_tour(p).length for p in
+        ...                    proper_permutations(list(tsp.cities))])
+        >>> abs(tsp.exact_tour()[0] - brute_force) < 1e-9
+        True
+    """
+    (length, tour) = held_karp(self.distances, processes)
+    return (length, Cities([self.cities[i] for i in tour]))
+
+  def lower_bound(self, iterations=100, upper_bound=None):
+    """ Return a lower bound on the length of any tour of these cities,
+        the held_karp_bound() (typically within 1% of the shortest).
+        This takes O(N**2) time for each of the iterations, and is
+        remembered until more iterations are asked for.
+        The upper_bound (default the length of self.tour, or of a
+        greedy one) steers the search; the closer it is the better.
+        >>> tsp = TSP(cities='test6')
+        >>> "%.2f" % tsp.lower_bound()
+        '7.17'
+    """
+    if self._lower_bound == None or self._lower_bound[1] < iterations:
+      if upper_bound == None and self.tour:
+        upper_bound = self.tour.length
+      elif upper_bound == None:
+        upper_bound = self.new_tour('greedy').length
+      (bound, pi) = held_karp_bound(self.xy, upper_bound, iterations)
+      self._lower_bound = (bound, iterations, pi)
+    return self._lower_bound[0]
+
+  def gap(self, tour=None):
+    """ Return how far the length of tour (default self.tour) is at
+        most above optimal, as a fraction; see lower_bound().
+        >>> tsp = TSP(cities='test6', tour=('A', 'D', 'C', 'E', 'B', 'F'))
+        >>> "%.3f" % tsp.gap()
+        '0.499'
+    """
+    tour = tour or self.tour
+    bound = self.lower_bound()
+    return max(0.0, tour.length - bound) / bound
+
   def init_TSP(self):
     """ Starting with self.cities,
         this sets up the various TSP internals and links between 'em :
-        0. Create self.roads.
-        1. Add a .tsp field within each city,
-        2. Create a Road for each pair of cities, and store 'em in two places:
-           a) in self.roads, and
-           b) in city.roads for each road's city endpoints.
-        3. Sort self.roads and city.roads by length.
+        1. Add .tsp and .index fields within each city;
+           city i is self.cities[i], with coordinates self.xy[i].
+        2. Create self.roads, which makes each Road only when it's needed.
+        The (N,N) self.distances array and the nearest neighbor lists
+        are also only built when they're first asked for.
     """
-    self.roads = Roads()
-    for city1 in self.cities:
-      city1.tsp = self
-      for city2 in self.cities:
-        if not self.roads.get(city1, city2) and not city1 == city2:
-          road = Road(city1, city2)
-          for c in (self, city1, city2):
-            c.roads.add(road)
-    self.roads.update_by_length()
-    for city in self.cities:
-      city.roads.update_by_length()
-
-  def LK(self, n_tries = 1):
+    for (i, city) in enumerate(self.cities):
+      city.tsp = self
+      city.index = i
+    self.xy = numpy.array([(city.x, city.y) for city in self.cities],
+                          dtype=float).reshape(-1, 2)
+    self.roads = RoadCache(self)
+    self._distances = None
+    self._neighbors = None        # (N, k) from self.neighbor_indices(k)
+    self._nearest_roads = {}      # city.index => roads sorted by length
+    self._lower_bound = None      # (bound, iterations, pi), lower_bound()
+    self._candidates = None       # (N, k) from self.candidate_indices(k)
+    self._candidate_roads = {}    # city.index => roads, best first
+    self._lk_merge_roads = None   # city.index => roads, in merge_tours()
+    self._lk_fixed = set()        # roads LK may not delete; fix_backbone()
+    self._lk_deadline = None      # clock() time when LK stops; anytime_LK()
+    self._lk_timed_out = False    #   and True once it's been passed
+    self._lk_slice_end = None     # clock() time when queue_improve returns
+
+  @property
+  def distances(self):
+    """ The (N,N) array of distances between all pairs of cities. """
+    # Only the exact and whole-graph methods need this;
+    # the LK search itself gets by with self.neighbor_indices().
+    if self._distances is None:
+      self._distances = distance_matrix(self.xy)
+    return self._distances
+
+  def neighbor_indices(self, k):
+    """ Return an (N, k) array whose row i is the indices of the k cities
+        nearest to city i, nearest first, found with a GridIndex.
+        >>> tsp = TSP(cities='test6')
+        >>> [tsp.cities[i].name for i in tsp.neighbor_indices(2)[0]]
+        ['B', 'F']
+        >>> neighbors = tsp.neighbor_indices(10)     # (only 5 other cities)
+        >>> (neighbors.shape, tsp.neighbor_indices(10).base is neighbors.base)
+        ((6, 5), True)
+    """
+    k = min(k, len(self.cities) - 1)
+    if self._neighbors is None or self._neighbors.shape[1] < k:
+      self._neighbors = GridIndex(self.xy).k_nearest(k)
+    return self._neighbors[:, :k]
+
+  def nearest_roads(self, city, m=-1):
+    """ Return a list of the m shortest roads from city, sorted by length.
+        m=-1 or None => all of them.
+        >>> tsp = TSP(cities='test6')
+        >>> map(str, tsp.nearest_roads(tsp.cities.get('A'), 3))
+        ['A--B (1.12)', 'A--F (1.51)', 'A--E (1.86)']
+    """
+    n_roads = len(self.cities) - 1
+    if m == None or m < 0 or m > n_roads:
+      m = n_roads
+    roads = self._nearest_roads.get(city.index)
+    if roads == None or len(roads) < m:
+      roads = [self.roads.get(city, self.cities[i])
+               for i in self.neighbor_indices(m)[city.index]]
+      roads.sort()
+      self._nearest_roads[city.index] = roads
+    return roads[:m]
+
+  def candidate_indices(self, k):
+    """ Return an (N, k) array whose row i is the indices of the k cities
+        that LK tries joining city i to, best first : by default the
+        nearest, or with lk_candidates='alpha' the alpha_nearest(),
+        from the penalties of lower_bound() and 4*k nearest cities.
+        >>> tsp = TSP(cities='test6')
+        >>> tsp.lk_candidates = 'alpha'
+        >>> [tsp.cities[i].name for i in tsp.candidate_indices(3)[0]]
+        ['B', 'F', 'E']
+        >>> tsp = TSP(cities=2, tour='random')
+        >>> tsp.lk_candidates = 'alpha'
+        >>> (tsp.candidate_indices(5).tolist(), tsp.LK())
+        ([[1], [0]], None)
+    """
+    if self.lk_candidates == 'nearest':
+      return self.neighbor_indices(k)
+    k = min(k, len(self.cities) - 1)
+    if self._candidates is None or self._candidates.shape[1] < k:
+      self.lower_bound()
+      pi = self._lower_bound[2]
+      nearby = self.neighbor_indices(max(4 * k, 20))
+      self._candidates = alpha_nearest(self.xy, pi, nearby, k)
+    return self._candidates[:, :k]
+
+  def candidate_roads(self, city, m=-1):
+    """ Return a list of the roads from city to its m candidate_indices().
+        m=-1 or None => all of them.
+        >>> tsp = TSP(cities='test6')
+        >>> map(str, tsp.candidate_roads(tsp.cities.get('A'), 2))
+        ['A--B (1.12)', 'A--F (1.51)']
+    """
+    if self._lk_merge_roads != None:
+      roads = self._lk_merge_roads[city.index]
+      return roads if m == None or m < 0 else roads[:m]
+    if self.lk_candidates == 'nearest':
+      return self.nearest_roads(city, m)
+    n_roads = len(self.cities) - 1
+    if m == None or m < 0 or m > n_roads:
+      m = n_roads
+    roads = self._candidate_roads.get(city.index)
+    if roads == None or len(roads) < m:
+      roads = [self.roads.get(city, self.cities[i])
+               for i in self.candidate_indices(m)[city.index]]
+      self._candidate_roads[city.index] = roads
+    return roads[:m]
+
+  def LK(self, n_tries = 1, processes=None, seed=None, gap_tolerance=None,
+         checkpoint=None, checkpoint_seconds=60, merge=None):
     """ Entry stub for Lin-Kernighan-ish improvement of self.tour .
         If n_tries > 1, the LK algorithm is run multiple times
         on different randomized starting tours, and the best
         result is returned.  (The mean and sd are stored
-        in self.lk_tour_mean and self.lk_tour_sigma)
+        in self.lk_tour_mean and self.lk_tour_sigma, and the
+        number of trials run in self.lk_tries)
+        If processes is given, the trials are shared out among
+        that many worker processes (-1 => one per cpu).
+        If seed is given, trial i starts with random.seed(seed + i),
+        so that the same trials can be run again, in parallel or not.
+        If gap_tolerance is given, the trials stop as soon as the best
+        tour is within that fraction of optimal, by gap().
+        If a checkpoint filename is given, the progress so far is saved
+        there after a trial at least every checkpoint_seconds (and at
+        the end), so that an interrupted run can be finished by resume().
+        If merge is given, that many of the best trial tours are kept,
+        and at the end merge_tours() searches the roads they use.
+
+        >>> tsp = TSP(cities='test6', tour=('A', 'D', 'C', 'E', 'B', 'F'))
+        >>> (tsp.lk_breadth, tsp.lk_max_nodes) = ((5, 3, 1), 20)
+        >>> tsp.LK(); "%.2f" % tsp.tour.length
+        '7.17'
+        >>> tsp.lk_stats.starts > 0
+        True
+        >>> tsp.lk_stats.nodes <= 20 * tsp.lk_stats.starts
+        True
+
+        >>> tsp = TSP(cities=30, tour='random')
+        >>> (tsp.lk_dont_look_bits, start) = (True, tsp.tour.city_sequence())
+        >>> tsp.LK(4, seed=1)
+        >>> serial = "%.6f %.6f" % (tsp.tour_length(), tsp.lk_tour_mean)
+        >>> tsp.tour = tsp.new_tour(start)
+        >>> tsp.LK(4, processes=2, seed=1)
+        >>> "%.6f %.6f" % (tsp.tour_length(), tsp.lk_tour_mean) == serial
+        True
+
+        >>> tsp = TSP(cities='test6', tour='random')
+        >>> tsp.LK(10, gap_tolerance=0.01)
+        >>> (tsp.gap() < 0.01, tsp.lk_tries)
+        (True, 1)
+
+        >>> import tempfile, os
+        >>> checkpoint = tempfile.mktemp()
+        >>> tsp = TSP(cities=30, tour='random')
+        >>> (tsp.lk_dont_look_bits, start) = (True, tsp.tour.city_sequence())
+        >>> tsp.LK(5, seed=2)
+        >>> whole = "%.6f %.6f" % (tsp.tour_length(), tsp.lk_tour_mean)
+        >>> tsp.tour = tsp.new_tour(start)
+        >>> tsp.LK(2, seed=2, checkpoint=checkpoint)   # as if stopped at 2
+        >>> state = pickle.load(open(checkpoint, 'rb'))
+        >>> state['args'] = (5,) + state['args'][1:]
+        >>> tsp.save_checkpoint(checkpoint, state)
+        >>> tsp.resume(checkpoint)
+        >>> resumed = "%.6f %.6f" % (tsp.tour_length(), tsp.lk_tour_mean)
+        >>> (resumed == whole, tsp.lk_tries)
+        (True, 5)
+        >>> os.remove(checkpoint)
+
+        >>> tsp = TSP(cities=60, tour='random')
+        >>> (tsp.lk_dont_look_bits, start) = (True, tsp.tour.city_sequence())
+        >>> tsp.LK(6, seed=4); best = tsp.tour_length()
+        >>> tsp.tour = tsp.new_tour(start)
+        >>> tsp.LK(6, seed=4, merge=4)
+        >>> tsp.tour_length() <= best + 1e-9
+        True
     """
     #
     #
@@ -924,29 +2629,55 @@ class TSP(object):
     #         path_search ->
     #              path_search        recursive path modifications
     #                 or
-    #              exception back to LK, if 'restart_better_tours'
-    for i in range(n_tries):
-      if i > 0:
-        self.randomize_tour()
-        if self.lk_verbose:
-          print
-          print "RANDOMIZING INITIAL TOUR; trial %i of %i" % (i, n_tries)
-          print
-      while True:
-        try:
-          self.tour = self.tour_improve(self.tour)
-          break
-        except RestartLK:
-          pass     # self.tour is now replaced, so just try again
-      length = self.tour_length()
-      if i == 0:
-        best_cities = Cities(self.tour.city_sequence())
-        tours = [length]
-      else:
-        if length < min(tours):
-          best_cities = Cities(self.tour.city_sequence())
-        tours.append(length)
-    self.tour = Tour(self, best_cities)
+    #              return back to tour_improve with a better tour,
+    #              if 'restart_better_tours', which then carries on
+    #
+    # With lk_dont_look_bits, tour_improve is queue_improve.
+    self.reset_lk_counters()
+    if checkpoint != None and seed == None:
+      seed = random.randrange(2**30)       # so trial i can be rerun
+    state = {'method': 'LK', 'tours': [], 'best': None,
+             'args': (n_tries, processes, seed, gap_tolerance),
+             'merge': merge, 'best_tours': []}
+    self.lk_run(state, checkpoint, checkpoint_seconds)
+
+  def lk_run(self, state, checkpoint=None, checkpoint_seconds=60):
+    """ Run (or continue) the LK trials described by state; see LK(). """
+    (n_tries, processes, seed, gap_tolerance) = state['args']
+    tours = state['tours']
+    (merge, best_tours) = (state.get('merge'), state.get('best_tours', []))
+    self.edge_counts = state.setdefault('edge_counts', {})
+    self.fix_backbone(len(tours))
+    if state['best'] is not None:
+      best_cities = Cities([self.cities[i] for i in state['best']])
+    saved = clock()
+    for (length, cities) in self.lk_trials(n_tries, processes, seed,
+                                           first=len(tours)):
+      if not tours or length < min(tours):
+        best_cities = Cities(cities)
+      tours.append(length)
+      if merge:
+        best_tours.append((length, [city.index for city in cities]))
+        best_tours.sort()
+        del best_tours[merge:]
+      self.count_edges(cities)
+      self.fix_backbone(len(tours))
+      done = len(tours) == n_tries
+      if gap_tolerance != None:
+        bound = self.lower_bound(upper_bound=min(tours))
+        done = done or min(tours) - bound <= gap_tolerance * bound
+      if checkpoint != None and (done or
+                                 clock() - saved >= checkpoint_seconds):
+        state['best'] = numpy.array([city.index for city in best_cities])
+        self.save_checkpoint(checkpoint, state)
+        saved = clock()
+      if done:
+        break                  # (which also stops any pool of workers)
+    self.lk_tries = len(tours)
+    self._lk_fixed = set()
+    self.tour = self.new_tour(best_cities)
+    if merge and len(best_tours) > 1:
+      self.merge_tours([order for (length, order) in best_tours])
     self.lk_tour_mean = average(tours)
     self.lk_tour_sigma = stdev(tours)
     if self.lk_verbose:
@@ -957,52 +2688,637 @@ class TSP(object):
             (self.lk_tour_mean, self.lk_tour_sigma)
       print
 
-  def tour_improve(self, tour):
-    """ loop over roads ; convert tour to path
-        and then start Lin-Kernighan-ish algorithm. """
-    (best_length, best_cities) = (tour.tour_length(), tour.city_sequence())
+  def count_edges(self, cities):
+    """ Add one to self.edge_counts[key] for each road in the tour
+        of these cities, where key is the road's i*N + j RoadCache key. """
+    n = len(self.cities)
+    order = numpy.array([city.index for city in cities], dtype=int)
+    after = numpy.roll(order, -1)
+    keys = numpy.minimum(order, after) * n + numpy.maximum(order, after)
+    for key in keys.tolist():
+      self.edge_counts[key] = self.edge_counts.get(key, 0) + 1
+
+  def fix_backbone(self, n_tours):
+    """ Fix the "backbone" roads, which LK trials then don't delete :
+        with lk_backbone set and at least lk_backbone_after tours counted,
+        the ones in at least that fraction of the n_tours tours so far.
+        LK() counts the roads of every trial's tour in self.edge_counts,
+        whether or not lk_backbone is set.
+        >>> tsp = TSP(cities='test6')
+        >>> (tsp.lk_backbone, tsp.lk_backbone_after) = (0.6, 2)
+        >>> tsp.edge_counts = {}
+        >>> tsp.count_edges(Tour(tsp, ('A', 'B', 'C', 'D', 'E', 'F')).cities)
+        >>> tsp.count_edges(Tour(tsp, ('A', 'B', 'C', 'D', 'F', 'E')).cities)
+        >>> tsp.fix_backbone(2)
+        >>> sorted(map(str, tsp._lk_fixed))
+        ['A--B (1.12)', 'B--C (1.13)', 'C--D (1.51)', 'E--F (0.90)']
+        >>> tsp = TSP(cities=60, tour='random')
+        >>> (tsp.lk_dont_look_bits, tsp.lk_backbone) = (True, 0.9)
+        >>> tsp.LK(6, seed=1)
+        >>> (len(tsp.tour), sum(tsp.edge_counts.values()), len(tsp._lk_fixed))
+        (60, 360, 0)
+        >>> tsp.lk_backbone = None
+        >>> tsp.LK(2, seed=1)
+        >>> sum(tsp.edge_counts.values())
+        120
+    """
+    # Most of the roads in one good tour are in all of 'em, so the later
+    # trials only search for better ways to join up the rest.
+    # With processes, the trials are handed out to the workers up front,
+    # so the backbone is only fixed for serial trials; either way, all of
+    # the tours are counted in self.edge_counts.
+    if self.lk_backbone == None or n_tours < self.lk_backbone_after:
+      self._lk_fixed = set()
+      return
+    (n, least) = (len(self.cities), self.lk_backbone * n_tours)
+    self._lk_fixed = set([self.roads.get(self.cities[key // n],
+                                         self.cities[key % n])
+                          for (key, count) in self.edge_counts.iteritems()
+                          if count >= least])
+
+  def merge_tours(self, tours):
+    """ Tour merging : improve self.tour by an LK search in which the
+        only roads it tries adding are the ones in these tours (each
+        a list of city indices), so that it searches just the sparse
+        graph of their union, and return its length.
+        >>> tsp = TSP(cities='test6', tour=('A', 'B', 'C', 'D', 'F', 'E'))
+        >>> "%.2f" % tsp.merge_tours([[0, 1, 2, 3, 5, 4], [1, 2, 3, 4, 0, 5]])
+        '7.17'
+    """
+    # Most of the roads in one good tour are in all the others, and the
+    # rest are all that a combination of them needs; that's usually a
+    # few more than two roads from each city, rather than the 10 or so
+    # lk_search_roads_per_city, so this search doesn't take long.
+    union = [set() for city in self.cities]
+    for order in tours:
+      for (i, j) in zip(order, order[1:] + order[:1]):
+        union[i].add(j)
+        union[j].add(i)
+    self._lk_merge_roads = dict([(city.index,
+                                  sorted([self.roads.get(city, self.cities[j])
+                                          for j in union[city.index]]))
+                                 for city in self.cities])
+    try:
+      length = self.lk_trial()
+    finally:
+      self._lk_merge_roads = None
+    if self.lk_verbose:
+      print "== merge_tours of %i tours; best is %s" % (len(tours),
+                                                        str(self.tour))
+    return length
+
+  def lk_trials(self, n_tries, processes=None, seed=None, first=0):
+    """ Generate (tour_length, city_sequence) for each of the LK trials
+        from number first on, in order; see LK() for the arguments. """
+    if processes != None:
+      for result in self.pool_trials(n_tries, processes, seed, first):
+        yield result
+      return
+    for i in range(first, n_tries):
+      if seed != None:
+        random.seed(seed + i)
+      if i > 0:
+        self.randomize_tour()
+        if self.lk_verbose:
+          print
+          print "RANDOMIZING INITIAL TOUR; trial %i of %i" % (i, n_tries)
+          print
+      yield (self.lk_trial(), self.tour.city_sequence())
+
+  def lk_trial(self, queue=None):
+    """ Improve self.tour until LK can't; return its length.
+        If a list of cities is given as queue, only search from
+        them and the cities near their improvements; see queue_improve. """
+    if queue == None:
+      (self._lk_queue, improve) = (None, self.tour_improve)
+    else:
+      self._lk_queue = collections.deque(queue)
+      self._lk_queued = set(queue)
+      improve = self.queue_improve
+    self.tour = improve(self.tour)
+    return self.tour_length()
+
+  def chained_LK(self, iterations=None, time_limit=None, seed=None,
+                 checkpoint=None, checkpoint_seconds=60):
+    """ Chained (or iterated) Lin-Kernighan improvement of self.tour.
+        After an LK trial, the best tour so far is repeatedly kicked
+        with a random double bridge, and then improved again by LK
+        searching from just the cities at the kick.  The result replaces
+        the best tour only if it's shorter.  This stops after
+        the given number of kicks, or once time_limit seconds have passed,
+        whichever comes first.  The checkpoint arguments are as in LK().
+        >>> tsp = TSP(cities=40, tour='random')
+        >>> (tsp.lk_dont_look_bits, start) = (True, tsp.tour.city_sequence())
+        >>> tsp.LK(); lk_length = tsp.tour_length()
+        >>> tsp.tour = tsp.new_tour(start)
+        >>> tsp.chained_LK(iterations=20, seed=1)
+        >>> (tsp.tour_length() <= lk_length, tsp.lk_stats.kicks)
+        (True, 20)
+    """
+    if iterations == None and time_limit == None:
+      raise Exception('chained_LK needs iterations or time_limit')
+    started = clock()
+    if seed != None:
+      random.seed(seed)
+    self.reset_lk_counters()
+    self.lk_trial()
+    state = {'method': 'chained_LK', 'args': (iterations, time_limit),
+             'elapsed': clock() - started,
+             'best': numpy.array([city.index
+                                  for city in self.tour.city_sequence()])}
+    self.chained_run(state, checkpoint, checkpoint_seconds)
+
+  def chained_run(self, state, checkpoint=None, checkpoint_seconds=60):
+    """ Run (or continue) the kicks described by state; see chained_LK(). """
+    (iterations, time_limit) = state['args']
+    (started, saved) = (clock() - state['elapsed'], clock())
+    best_cities = Cities([self.cities[i] for i in state['best']])
+    best_length = self.order_length(state['best'])
+    while iterations == None or self.lk_stats.kicks < iterations:
+      if time_limit != None and clock() - started > time_limit:
+        break
+      if checkpoint != None and clock() - saved >= checkpoint_seconds:
+        state['best'] = numpy.array([city.index for city in best_cities])
+        state['elapsed'] = clock() - started
+        self.save_checkpoint(checkpoint, state)
+        saved = clock()
+      (cities, kicked) = self.kick(best_cities)
+      self.tour = self.new_tour(cities)
+      self.lk_stats.kicks += 1
+      length = self.lk_trial(kicked)
+      if length + 1e-6 < best_length:
+        (best_length, best_cities) = (length, Cities(self.tour.city_sequence()))
+        self.lk_stats.kicks_improved += 1
+        if self.lk_verbose:
+          print "== kick %i improved tour to %f" % (self.lk_stats.kicks, length)
+    self.tour = self.new_tour(best_cities)
+    if checkpoint != None:
+      state['best'] = numpy.array([city.index for city in best_cities])
+      state['elapsed'] = clock() - started
+      self.save_checkpoint(checkpoint, state)
+
+  def anytime_LK(self, time_limit, seed=None, interval=1.0):
+    """ Generate (tour_length, elapsed_seconds, cities) for each shorter
+        tour found, by a "don't look bits" LK search of self.tour (see
+        queue_improve) and then chained_LK kicks, stopping at time_limit
+        seconds.  Whenever one is generated, and afterwards, self.tour
+        is the best tour so far; stop early by breaking out of the loop.
+        The first LK search is cut into slices, 1/64 of interval (or of
+        time_limit if that's less) at first and doubling up to interval,
+        with its tour generated after each one that makes it shorter,
+        so that there are early results even with a short time limit.
+        A shorter tour found too close to the time limit to list its
+        cities is kept in self.tour, but isn't generated.
+        >>> tsp = TSP(cities=100, tour='random')
+        >>> found = list(tsp.anytime_LK(1.0, seed=1))
+        >>> lengths = [length for (length, elapsed, cities) in found]
+        >>> (lengths == sorted(lengths, reverse=True),
+        ...  tsp.tour_length() <= lengths[-1] + 1e-6,
+        ...  found[0][1] < 0.5, found[-1][1] < 1.0)
+        (True, True, True, True)
+        >>> best = tsp.tour_length()
+        >>> for (length, elapsed, cities) in tsp.anytime_LK(5.0):
+        ...   break
+        >>> ("%.6f" % length == "%.6f" % tsp.tour_length(), length < best)
+        (True, True)
+
+        While the generator waits at a yield, the TSP has no time limit,
+        so other searches can run on it in the meantime.
+        >>> found = tsp.anytime_LK(0.2, seed=1, interval=0.05)
+        >>> tsp.tour = tsp.new_tour('random'); first = found.next()
+        >>> time.sleep(0.2)                  # (past its time limit)
+        >>> tsp.tour = tsp.new_tour('random'); length = tsp.tour_length()
+        >>> tsp.LK()
+        >>> (tsp.lk_stats.starts > 0, tsp.tour_length() < length / 2)
+        (True, True)
+    """
+    # The time limit is hard.  The searches are told to stop early by the
+    # longest step so far that can't be cut short : listing the cities, a
+    # kick (which builds a new Tour), or a search backing out within 64
+    # nodes after it's told to stop.  Those steps are only started if
+    # there's time for them, and the best tour is kept as a Tour rather
+    # than rebuilt from its cities at the end.
+    started = clock()
+    deadline = started + time_limit
+    if seed != None:
+      random.seed(seed)
+    self.reset_lk_counters()
+    (best_tour, best_length) = (self.tour, self.tour_length())
+    best_cities = Cities(self.tour.city_sequence())
+    # The longest of those steps; to start with, listing a changed tour's
+    # cities takes about 3 times this copy.
+    longest = 3 * (clock() - started)
+    self._lk_queue = collections.deque(best_cities)
+    self._lk_queued = set(self._lk_queue)
+    slice_seconds = min(interval, time_limit) / 64.0
+    try:
+      while self._lk_queue and clock() + longest < deadline:
+        stop = min(deadline - longest, clock() + slice_seconds)
+        self.set_lk_deadline(deadline - longest, stop)
+        slice_seconds = min(2 * slice_seconds, interval)
+        self.tour = self.queue_improve(self.tour)
+        self.set_lk_deadline(None)
+        longest = max(longest, clock() - stop)
+        if self.tour_length() + 1e-6 < best_length and \
+           clock() + longest < deadline:
+          listed_at = clock()
+          (best_length, best_cities) = (self.tour_length(),
+                                        Cities(self.tour.city_sequence()))
+          longest = max(longest, clock() - listed_at)
+          yield (best_length, clock() - started, best_cities)
+      best_tour = self.tour
+      while clock() + 2 * longest < deadline:
+        kicked_at = clock()
+        (cities, kicked) = self.kick(best_cities)
+        self.tour = self.new_tour(cities)
+        longest = max(longest, clock() - kicked_at)
+        self.lk_stats.kicks += 1
+        stop = deadline - longest
+        self.set_lk_deadline(stop)
+        length = self.lk_trial(kicked)
+        self.set_lk_deadline(None)
+        longest = max(longest, clock() - stop)
+        if length + 1e-6 < best_length:
+          (best_tour, best_length) = (self.tour, length)
+          self.lk_stats.kicks_improved += 1
+          if clock() + longest < deadline:
+            listed_at = clock()
+            best_cities = Cities(self.tour.city_sequence())
+            longest = max(longest, clock() - listed_at)
+            yield (best_length, clock() - started, best_cities)
+        else:
+          self.tour = best_tour
+    finally:
+      self.set_lk_deadline(None)
+      if self.tour_length() > best_length + 1e-6:
+        self.tour = best_tour
+
+  def set_lk_deadline(self, deadline, slice_end=None):
+    """ Stop LK searches once clock() passes deadline (None => never),
+        and queue_improve between cities once it passes slice_end. """
+    (self._lk_deadline, self._lk_slice_end) = (deadline, slice_end)
+    self._lk_timed_out = False
+
+  def save_checkpoint(self, filename, state):
+    """ Save the state of an LK() or chained_LK() run to filename,
+        along with the LK settings and counters and the state of
+        the random number generator, for resume(). """
+    # This is O(N) (the best tour) plus O(trials), but it's written
+    # only every checkpoint_seconds; and like save_array it's written
+    # to one side and renamed into place, so a crash midway through
+    # leaves the last checkpoint as it was.
+    state = dict(state, key=instance_key(self.xy), settings=self.lk_settings(),
+                 random_state=random.getstate())
+    temporary = '%s.%i.tmp' % (filename, os.getpid())
+    f = open(temporary, 'wb')
+    try:
+      pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    finally:
+      f.close()
+    os.rename(temporary, filename)
+
+  def resume(self, filename, checkpoint_seconds=60):
+    """ Finish the LK() or chained_LK() run that was saving checkpoints
+        to filename (and carry on saving them there), as if it had never
+        stopped.  These must be the same cities, though not necessarily
+        the same TSP or even the same process.
+        >>> import tempfile, os
+        >>> checkpoint = tempfile.mktemp()
+        >>> tsp = TSP(cities=40, tour='random')
+        >>> tsp.lk_dont_look_bits = True
+        >>> tsp.chained_LK(iterations=30, seed=3, checkpoint=checkpoint)
+        >>> tsp.lk_stats.kicks
+        30
+        >>> state = pickle.load(open(checkpoint, 'rb'))
+        >>> state['args'] = (50, None)
+        >>> tsp.save_checkpoint(checkpoint, state)
+        >>> tsp2 = TSP(cities=[City(c.name, c.x, c.y) for c in tsp.cities])
+        >>> tsp2.resume(checkpoint)
+        >>> (tsp2.lk_stats.kicks, tsp2.tour_length() < tsp.tour_length() + 1e-6)
+        (50, True)
+        >>> os.remove(checkpoint)
+    """
+    state = pickle.load(open(filename, 'rb'))
+    if state.pop('key') != instance_key(self.xy):
+      raise Exception('checkpoint %s is for different cities' % filename)
+    vars(self).update(state.pop('settings'))
+    random.setstate(state.pop('random_state'))
+    run = {'LK': self.lk_run, 'chained_LK': self.chained_run}[state['method']]
+    run(state, filename, checkpoint_seconds)
+
+  def kick(self, cities):
+    """ Return (kicked_cities, changed_cities), a random double bridge
+        of a sequence of cities with all three of its cuts
+        within lk_kick_span cities, and the cities at its cuts. """
+    n = len(cities)
+    if n < 8:
+      return (Cities(cities), [])
+    r = random.randrange(n)
+    cities = list(cities[r:]) + list(cities[:r])
+    span = max(min(n, self.lk_kick_span), 4)
+    (i, j, k) = sorted(random.sample(range(1, span), 3))
+    changed = [cities[i-1], cities[i], cities[j-1], cities[j],
+               cities[k-1], cities[k]]
+    return (Cities(double_bridge(cities, i, j, k)), changed)
+
+  def partition_LK(self, cell_size=500, processes=None, seed=None):
+    """ Lin-Kernighan for instances too big to search all at once, by
+        Karp-style partitioning : the cities are split into kd_cells()
+        of at most cell_size cities, each cell's tour is found by LK
+        from a greedy start (shared out among that many worker processes
+        if processes is given, -1 => one per cpu), the tours are joined
+        by splice_tours(), and then an LK search from the cities with
+        one of their nearest neighbors in another cell repairs the joins.
+        Only one cell at a time (in each process) has a TSP of its own,
+        so apart from this TSP's O(N) cities and O(N k) neighbor lists
+        the memory used depends on cell_size, not N.
+        >>> tsp = TSP(cities=200, tour='random')
+        >>> tsp.lk_dont_look_bits = True
+        >>> tsp.partition_LK(cell_size=40, seed=1)
+        >>> (len(tsp.tour), tsp.tour_length() < tsp.new_tour('greedy').length)
+        (200, True)
+        >>> tsp.lk_stats.starts > 0
+        True
+    """
+    self.reset_lk_counters()
+    if seed != None:
+      random.seed(seed)
+    cells = kd_cells(self.xy, cell_size)
+    settings = self.lk_settings()
+    tasks = [(self.xy[cell], settings, random.randrange(2**30))
+             for cell in cells]
+    if processes == None:
+      results = map(_pool_cell_tour, tasks)
+    else:
+      if processes < 0:
+        processes = multiprocessing.cpu_count()
+      pool = multiprocessing.Pool(processes)
+      try:
+        results = pool.map(_pool_cell_tour, tasks)
+      finally:
+        pool.terminate()
+        pool.join()
+    tours = []
+    for (cell, (order, stats)) in zip(cells, results):
+      tours.append(cell[order])
+      self.lk_stats.add(stats)
+    order = splice_tours(self.xy, tours)
+    self.tour = self.new_tour(Cities([self.cities[i] for i in order]))
+    in_cell = numpy.empty(len(self.cities), dtype=int)
+    for (c, cell) in enumerate(cells):
+      in_cell[cell] = c
+    neighbors = self.neighbor_indices(min(max(self.lk_search_roads_per_city,
+                                              1), len(self.cities) - 1))
+    boundary = (in_cell[neighbors] != in_cell[:, numpy.newaxis]).any(axis=1)
+    self.lk_trial([self.cities[i] for i in numpy.flatnonzero(boundary)])
+    if self.lk_verbose:
+      print "== partition_LK of %i cells; best is %s" % (len(cells),
+                                                        str(self.tour))
+
+  def multilevel_LK(self, coarsest=200, seed=None):
+    """ Multilevel Lin-Kernighan : the cities are coarsen()'ed over and
+        over into fewer and fewer until there are at most coarsest of
+        'em, LK finds a tour of those from a greedy start, and then
+        each level's tour is uncoarsen()'ed into a starting tour for the
+        level below, which is refined by a "don't look bits" LK search
+        (see queue_improve) from each of its cities.
+        >>> tsp = TSP(cities=300, tour='random')
+        >>> tsp.multilevel_LK(coarsest=40, seed=1)
+        >>> (len(tsp.tour), tsp.tour_length() < tsp.new_tour('greedy').length)
+        (300, True)
+    """
+    self.reset_lk_counters()
+    if seed != None:
+      random.seed(seed)
+    (levels, xy) = ([], self.xy)
+    while len(xy) > max(coarsest, 3):
+      neighbors = GridIndex(xy).k_nearest(min(5, len(xy) - 1))
+      (coarse_xy, first, last) = coarsen(xy, neighbors)
+      levels.append((xy, coarse_xy, first, last))
+      xy = coarse_xy
+    settings = self.lk_settings()
+    (order, stats) = _pool_cell_tour((xy, settings, random.randrange(2**30)))
+    self.lk_stats.add(stats)
+    for (xy, coarse_xy, first, last) in reversed(levels):
+      order = uncoarsen(xy, coarse_xy, order, first, last)
+      if xy is self.xy:
+        tsp = self
+      else:
+        tsp = TSP(cities=xy)
+        vars(tsp).update(settings)
+        tsp.reset_lk_counters()
+      tsp.tour = tsp.new_tour(Cities([tsp.cities[i] for i in order]))
+      tsp.lk_trial(list(tsp.tour.city_sequence()))
+      if tsp is not self:
+        self.lk_stats.add(tsp.lk_stats)
+        order = [city.index for city in tsp.tour.city_sequence()]
+      if self.lk_verbose:
+        print "== multilevel_LK level of %i cities; length %f" % \
+              (len(xy), tsp.tour_length())
+    if not levels:
+      self.tour = self.new_tour(Cities([self.cities[i] for i in order]))
+
+  def pool_trials(self, n_tries, processes, seed=None, first=0):
+    """ Generate the results of lk_trials() from a pool of processes. """
+    # Each worker builds its own small TSP around the shared arrays,
+    # so only each trial's seed and the resulting city indices are
+    # pickled between processes.  Without a seed each trial still needs
+    # its own, or the forked random number generators would all agree.
+    if processes < 0:
+      processes = multiprocessing.cpu_count()
+    if seed == None:
+      seeds = [random.randrange(2**30) for i in range(n_tries)]
+    else:
+      seeds = [seed + i for i in range(n_tries)]
+    if first == 0:
+      start = [city.index for city in self.tour.city_sequence()]
+    tasks = [(i, seeds[i], start if i == 0 else None)
+             for i in range(first, n_tries)]
+    pool = multiprocessing.Pool(processes, _pool_init, (self.shared_arrays(),))
+    try:
+      for (length, indices, stats) in pool.imap(_pool_lk_trial, tasks):
+        self.lk_stats.add(stats)
+        yield (length, [self.cities[i] for i in indices])
+    finally:
+      pool.terminate()
+      pool.join()
+
+  def reset_lk_counters(self):
+    """ Zero the counts of the LK search effort in self.lk_stats. """
+    self.lk_stats = LKStats()
+
+  def start_path_search(self, path):
+    """ Return path_search(path), counting it as a new start
+        with its own allowance of lk_max_nodes nodes.  Afterwards
+        self._lk_accepted is True if the path was left as a better tour. """
+    self.lk_stats.starts += 1
+    (self._lk_start_nodes, self._lk_accepted) = (0, False)
+    result = self.path_search(path)
+    if self.lk_max_nodes and self._lk_start_nodes >= self.lk_max_nodes:
+      self.lk_stats.node_limit_hits += 1
+    return result
 
+  def tour_improve(self, tour):
+    """ Sweep over the roads of the tour, converting it to a path
+        without each one and starting the Lin-Kernighan-ish path_search.
+        With lk_restart_better_tours, each better tour is taken as soon
+        as it's found, and the sweep carries on from there over the roads
+        still in it, again and again until a whole sweep finds nothing.
+        Otherwise this is one sweep, and the best of its paths is kept. """
+    if self.lk_dont_look_bits:
+      return self.queue_improve(tour)
+    (best_length, best_cities) = (tour.tour_length(), None)
     self._lk_tour_length = tour.tour_length() # best known so far
-    loop_roads = Roads(tour) # loop over a duplicate; tour will be modified.
-    # loop_roads.update_by_length()  # sort; keeps things deterministic
-    # roads_by_length = loop_roads.by_length
-    # roads_list = list(tour)
-
+    improved = True
+    while improved:
+      improved = False
+      # Loop over a copy; the tour will be modified.
+      # (Its order isn't deterministic for a Tour, a set of roads.)
+      loop_roads = list(tour)
+      if self.lk_verbose:
+        print "===== starting tour_improve with %i paths to check" % \
+              (2*len(loop_roads))
+      for road in loop_roads:
+        for backward in (True, False):
+          if not road in tour or road in self._lk_fixed:
+            break          # gone in an improvement earlier, or not to go
+          tour.tour2path(road, backward)
+          if self.lk_verbose:
+            print "---- calling path_search on %s " % str(tour)
+          (length, moves) = self.start_path_search(tour)
+          if self.lk_verbose:
+            print "---- done path_search; found length=%f" % length
+          if self._lk_accepted:
+            tour.close()
+            self._lk_tour_length = tour.tour_length()
+            improved = True
+            continue
+          if length < best_length:
+            for mod in moves:
+              tour.modify(*mod)
+            best_length = length
+            best_cities = tour.city_sequence()
+          tour.revert()
+    if best_cities:
+      tour = self.new_tour(best_cities)
+    if self.lk_verbose:
+      print "===== finished tour_improve; best is %s " % str(tour)
+    return tour
+
+  def queue_improve(self, tour):
+    """ The "don't look bits" version of tour_improve.
+        Rather than starting a path_search from every road on every pass,
+        cities wait in self._lk_queue (initially all of 'em, in tour order).
+        Each one taken from the queue is the fixed end of a search
+        after removing each of its two tour roads in turn, and
+        an improvement puts the cities at the ends of the changed roads
+        back in the queue.  The tour is done when the queue is empty.
+        It returns early, with the rest of the queue left for another
+        call, between cities once clock() passes the slice_end given to
+        set_lk_deadline(), or as soon as it passes the deadline.
+        >>> tsp = TSP(cities=100, tour='random')
+        >>> (start, tsp._lk_queue) = (tsp.tour.city_sequence(), None)
+        >>> whole = tsp.queue_improve(tsp.tour).tour_length()
+        >>> (tsp.tour, tsp._lk_queue) = (tsp.new_tour(start), None)
+        >>> slices = 0
+        >>> while slices == 0 or tsp._lk_queue:
+        ...   tsp.set_lk_deadline(None, clock() + 0.0001)
+        ...   tsp.tour = tsp.queue_improve(tsp.tour)
+        ...   slices += 1
+        >>> (slices > 1, "%.6f" % tsp.tour_length() == "%.6f" % whole)
+        (True, True)
+    """
+    # A city's "don't look bit" is on when it's not in the queue.
+    if self._lk_queue == None:
+      self._lk_queue = collections.deque(tour.city_sequence())
+      self._lk_queued = set(self._lk_queue)
+    self._lk_tour_length = tour.tour_length()
     if self.lk_verbose:
-      print "===== starting tour_improve with %i paths to check" % \
-            (2*len(loop_roads))
-    i = 0
-    for road in loop_roads:        # no sort; works, but expect order to vary
-    #for road in roads_by_length:  # sorted ... but still not deterministic
-    # for road in roads_list:      # still not deterministic.  I give up.
+      print "===== starting queue_improve with %i cities queued" % \
+            len(self._lk_queue)
+    while self._lk_queue:
+      if self._lk_deadline != None and clock() > self._lk_deadline:
+        self._lk_timed_out = True
+        break     # leaving the rest of the queue for later
+      if self._lk_slice_end != None and clock() > self._lk_slice_end:
+        break
+      city = self._lk_queue.popleft()
+      self._lk_queued.discard(city)
       for backward in (True, False):
-        i += 1
-        tour.revert()
+        # Either way, tour2path leaves city as path.first.
+        if backward:
+          road = tour.get(city, tour.next_city(city))
+        else:
+          road = tour.get(tour.prev_city(city), city)
+        if road in self._lk_fixed:
+          continue
         tour.tour2path(road, backward)
         if self.lk_verbose:
-          print "---- calling %i path_search on %s " % (i, str(tour))
-        tour2 = self.path_search(tour)
-        if self.lk_verbose:
-          print "---- done path_search; found length=%f" % tour2.tour_length()
-        if tour2.tour_length() < best_length:
-          best_length = tour2.tour_length()
-          best_cities = tour2.city_sequence()
-    best_tour = Tour(self, best_cities)
+          print "---- calling path_search on %s " % str(tour)
+        (length, moves) = self.start_path_search(tour)
+        if self._lk_accepted or length + 1e-6 < self._lk_tour_length:
+          if not self._lk_accepted:
+            for mod in moves:
+              tour.modify(*mod)
+          self.queue_cities([road, self.roads.get(tour.first, tour.last)] +
+                            [road_add for (c, road_add, r) in moves] +
+                            [road_rm for (c, a, road_rm) in moves])
+          tour.close()
+          self._lk_tour_length = tour.tour_length()
+          if self.lk_verbose:
+            print "---- improved by path_search to %s" % str(tour)
+        else:
+          tour.revert()
+        if self._lk_timed_out:
+          # The search from city was cut short, so it goes back first in
+          # line for any later call, rather than losing its turn.
+          if city in self._lk_queued:
+            self._lk_queue.remove(city)
+          self._lk_queue.appendleft(city)
+          self._lk_queued.add(city)
+          break
     if self.lk_verbose:
-      print "===== finished tour_improve; best is %s " % str(best_tour)
-    return best_tour
-
-  def path_search(self, path, added=None, deleted=None):
-    """ Recursive part of search for an improved TSP solution. """
+      print "===== finished queue_improve; best is %s " % str(tour)
+    return tour
+
+  def queue_cities(self, roads):
+    """ Put the cities at the ends of these roads into self._lk_queue,
+        unless they're already waiting there. """
+    for road in roads:
+      for city in road:
+        if not city in self._lk_queued:
+          self._lk_queued.add(city)
+          self._lk_queue.append(city)
+
+  def path_search(self, path, added=None, deleted=None, moves=None):
+    """ Recursive part of search for an improved TSP solution.
+        Returns (tour_length, moves) for the best tour found, where moves
+        is the list of (city, road_add, road_rm) path modifications
+        that lead to it.  The path itself is left as it was, except
+        with lk_restart_better_tours : then the search stops at the first
+        tour shorter than self._lk_tour_length, leaving the path as that
+        tour and setting self._lk_accepted, for the caller to close().
+    """
+    # Only the moves are remembered, not the tours they lead to;
+    # the caller can replay 'em with path.modify(*move) .
     if not added:
       added = set()
     if not deleted:
       deleted = set()
+    if not moves:
+      moves = []
 
-    depth = len(added)  # = len(deleted)
-    (old_tour_length, old_cities) = (path.tour_length(), path.city_sequence())
-    results = [(old_tour_length, old_cities)]
+    depth = len(added)  # = len(deleted) = len(moves)
+    old_tour_length = path.tour_length()
+    (best_length, best_moves) = (old_tour_length, list(moves))
     mods = path.find_lk_mods(added, deleted)
+    if self.lk_breadth:
+      mods = mods[:self.lk_breadth[min(depth, len(self.lk_breadth) - 1)]]
+    self.lk_stats.nodes += 1
+    self.lk_stats.count_depth(depth)
+    self._lk_start_nodes += 1
+    if self._lk_deadline != None and self.lk_stats.nodes % 64 == 0:
+      self._lk_timed_out = clock() > self._lk_deadline
 
     if self.lk_verbose:
       print " "*depth + "  -- path_search " + \
@@ -1011,11 +3327,16 @@ class TSP(object):
 
     for (city, road_add, road_rm) in mods:
 
+      if self._lk_timed_out or \
+         (self.lk_max_nodes and self._lk_start_nodes >= self.lk_max_nodes):
+        break     # and likewise back up through the recursion
+
       if self.lk_verbose:
         print " "*depth + "  -> (city, road_add, road_rm) = (%s, %s, %s) " % \
               (str(city), str(road_add), str(road_rm))
 
       path.modify(city, road_add, road_rm)
+      self.lk_stats.mods_tried += 1
 
       if self.lk_verbose:
         print " "*depth + "  -> modified path %s " % str(path)
@@ -1025,33 +3346,89 @@ class TSP(object):
           # The 1e-6 is a round-off error fudge factor;
           # I think it sometimes thinks the same tour is a bit shorter,
           # maybe if the roads are added up in a different order.
-        self.tour = Tour(self, Cities(path.city_sequence()))
+        # Take this better tour right away, returning straight back up
+        # through the recursion without undoing any of the modifications.
+        moves.append((city, road_add, road_rm))
+        self._lk_accepted = True
+        self.lk_stats.accepted += 1
         if self.lk_verbose:
-          print "!! restart with better tour ; using %s" % str(self.tour)
-        # Restart the whole search, all the back to LK, with this better tour
-        raise RestartLK()
+          print "!! accepting better tour %s" % str(path)
+        return (path.tour_length(), list(moves))
 
       added.add(road_add)
       deleted.add(road_rm)
+      moves.append((city, road_add, road_rm))
 
       if self.lk_depth_limit and depth > self.lk_depth_limit:
-        result_path = path
+        (length, result_moves) = (path.tour_length(), list(moves))
       else:
-        result_path = self.path_search(path, added, deleted)
-      results.append((result_path.tour_length(), result_path.city_sequence()))
+        (length, result_moves) = self.path_search(path, added, deleted, moves)
+        if self._lk_accepted:
+          return (length, result_moves)
+      if length < best_length:
+        (best_length, best_moves) = (length, result_moves)
 
       if self.lk_verbose:
-        print " "*depth + "  -> result path=%f; tour=%f" % \
-              (result_path.length, result_path.tour_length())
+        print " "*depth + "  -> result tour=%f" % length
 
       added.remove(road_add)
       deleted.remove(road_rm)
+      moves.pop()
 
       path.unmodify(city, road_add, road_rm)
 
     # Finished breadth search at this depth ; return best result
-    (best_length, best_city_seq) = min(results)
-    return Tour(self, best_city_seq)
+    return (best_length, best_moves)
+
+# - - - parallel trials - - -
+
+_pool_tsp = None     # The TSP in each worker process of TSP.pool_trials.
+
+def _pool_init(shared):
+  """ Set up a worker process for TSP.pool_trials,
+      given the result of TSP.shared_arrays(). """
+  global _pool_tsp
+  _pool_tsp = TSP.from_shared(shared)
+
+def _pool_lk_trial((i, seed, start)):
+  """ Run one trial of TSP.pool_trials in a worker process, returning
+      (tour_length, city indices, LKStats of the search). """
+  tsp = _pool_tsp
+  random.seed(seed)
+  if start:
+    tsp.tour = tsp.new_tour([tsp.cities[k] for k in start])
+  else:
+    tsp.randomize_tour()
+  tsp.reset_lk_counters()
+  length = tsp.lk_trial()
+  indices = [city.index for city in tsp.tour.city_sequence()]
+  return (length, indices, tsp.lk_stats)
+
+def _pool_cell_tour((xy, settings, seed)):
+  """ Return (order, LKStats of the search) for an LK tour of the cities
+      at xy, one cell of TSP.partition_LK (or the coarsest level of
+      TSP.multilevel_LK), using these lk_settings(). """
+  if len(xy) < 4:
+    return (range(len(xy)), LKStats())       # any order is as good
+  random.seed(seed)
+  tsp = TSP(cities=xy)
+  vars(tsp).update(settings)
+  tsp.reset_lk_counters()
+  tsp.tour = tsp.new_tour('greedy')
+  tsp.lk_trial()
+  return ([city.index for city in tsp.tour.city_sequence()], tsp.lk_stats)
+
+_pool_held_karp = None  # The arrays in each worker process of held_karp.
+
+def _pool_held_karp_init(cost, parent, d, layers):
+  """ Set up a worker process for held_karp, with its shared arrays. """
+  global _pool_held_karp
+  _pool_held_karp = (cost, parent, d, layers)
+
+def _pool_held_karp_step((k, columns)):
+  """ Run held_karp_step for these columns of sets of size k. """
+  (cost, parent, d, layers) = _pool_held_karp
+  held_karp_step(cost, parent, d, layers[k], columns)
 
 # - - - analysis - - -
 
@@ -1075,7 +3452,8 @@ def stdev(numbers, sample=True):
   # sigma = population standard deviation = <(x-<x>)**2> = <x**2> - <x>**2
   # s = sample standard deviation = sqrt(n/(n-1)) * sigma
   numbers_squared = map(lambda x: x**2, numbers)
-  sigma = math.sqrt(average(numbers_squared) - (average(numbers))**2)
+  # (max() since round-off can make this a bit negative if all x are equal)
+  sigma = math.sqrt(max(0.0, average(numbers_squared) - (average(numbers))**2))
   n = float(len(numbers))
   if sample and n > 1:
     return math.sqrt(n/(n-1)) * sigma
@@ -1111,12 +3489,12 @@ def stats_random_samestart(n_cities, m_times):
 def random_tsp(N):
   """ Return (time, tour_length, tour_length_LK)
       for an LK tour improvement with N random cities. """
-  start_time = time.clock()
+  start_time = clock()
   tsp = TSP(cities=N, tour='random')
   tour_length = tsp.tour_length()
   tsp.LK()
   tour_length_LK = tsp.tour_length()
-  return (time.clock() - start_time, tour_length, tour_length_LK)
+  return (clock() - start_time, tour_length, tour_length_LK)
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -1138,9 +3516,17 @@ def main():
   if False:
     N = 10                        # N=9 brute force : 6 sec ; 10 : 3.5 min (mac laptop)
     tspN = TSP(cities=N, tour='random')
-    start_time = time.clock()
+    start_time = clock()
     tspN.print_brute_force()
-    print "elapsed time: %8.2f sec" % (time.clock() - start_time)
+    print "elapsed time: %8.2f sec" % (clock() - start_time)
+
+  if False:                       # exact solution ; N=20 takes about 1 sec
+    N = 20
+    tspN = TSP(cities=N)
+    start_time = clock()
+    (length, cities) = tspN.exact_tour()
+    print "best is %s" % str(tspN.new_tour(cities))
+    print "elapsed time: %8.2f sec" % (clock() - start_time)
 
   if False:                      # see the search in action 
     # This spits out a lot of text;
@@ -1165,40 +3551,32 @@ def main():
     print "  outputting to '%s'" % graphname2
     tsp50.graph(graphname2, all_lines=False, scale=10)
 
-  if False:                        # timing for various number of cities
-    format_numbers = " %4i   %5.2f  +-%5.2f    %8.2f   %8.2f "
-    format_strings = " %4s   %5s  %7s    %8s   %8s "
-    print format_strings % ('n', 'time', 'sigma', 'tour', 'lk_tour')
-    print format_strings % ('-'*4, '-'*5, '-'*7, '-'*8, '-'*8)
-    for n in (5, 10, 20, 40, 80):
-      results = stats_random_tsp(n, 8)
-      print format_numbers % (n, results[0][0], results[0][1], results[1][0], results[2][0])
+  # For timing over various numbers of cities (and for comparing
+  # versions of this code) see benchmark.py, e.g.
+  #   $ python benchmark.py --sizes 5,10,20,40,80 --seeds 1,2,3,4 --json t.json
 
   if True:                         # timing for one big TSP
     # Approx times on my mac laptop: N=100: 5sec; N=200: 44 sec; N=300: 200 sec
     N = 300
     print "-- TSP with %i random cities --" % N
-    t0 = time.clock()
+    t0 = clock()
     tspN = TSP(cities=N, tour='random')
     initial_length = tspN.tour_length()
-    t1 = time.clock()
+    t1 = clock()
     print (" %.2f sec elapsed : original is " % (t1 - t0)) + str(tspN)
     tspN.LK()
-    t2 = time.clock()
+    t2 = clock()
     print (" %.2f sec elapsed : LK is " % (t2 - t1)) + str(tspN)
+    print " " + str(tspN.lk_stats)
 
 # - - - generic doctest and running main - - - 
-
-#if __name__ == "__main__":
-#  doctest.testmod()
-#  main()
-
-# - - - code profile analysis  - - - - - - - 
-
-import cProfile
-cProfile.run('main()', 'profile_N300.out')
 #
-# To look at the profile dump,
+# Running this file runs main().  Importing it doesn't.
+# To profile main(), give a filename for the profile dump, e.g.
+#
+#   $ LK_TSP_PROFILE=profile_N300.out python LK_TSP.py
+#
+# and to look at the profile dump,
 # see http://docs.python.org/library/profile.html e.g.
 #
 #   $ python
@@ -1210,3 +3588,12 @@ cProfile.run('main()', 'profile_N300.out')
 #
 # Here "cumulative" is time spent in a function including sub calls,
 # while "time" is the time only in that function, not child calls.
+# The profiler slows everything down several times over ;
+# tsp.lk_stats has the counts of the LK hot paths without it.
+
+if __name__ == "__main__":
+  if os.environ.get('LK_TSP_PROFILE'):
+    import cProfile
+    cProfile.run('main()', os.environ['LK_TSP_PROFILE'])
+  else:
+    main()
@@ -0,0 +1,265 @@
+"""
+ benchmark.py
+
+ Timing of the phases of solving a TSP - setting it up, building
+ starting tours, LK improvement (of the whole TSP, or of kd_cells of
+ --cell-size cities with partition_LK), the shortest tour anytime_LK
+ finds in --anytime-seconds, exact solutions and drawing it -
+ over a grid of problem sizes and random seeds, written as JSON or CSV
+ so that one version of the code can be compared with another.
+
+   $ python benchmark.py --sizes 100,200,400 --seeds 1,2,3 --json new.json
+   $ python benchmark.py --compare old.json new.json
+   $ python benchmark.py --sizes 100000 --phases partition --processes -1
+   $ python benchmark.py --sizes 2000 --phases anytime --anytime-seconds 10
+
+ Each phase is run --warmup times untimed, and then --repeat times
+ with the monotonic LK_TSP.clock(); the fastest and median times are
+ recorded, along with the tour length found.  The comparison lists
+ the phases that are more than --tolerance slower, and exits with
+ status 1 if there are any.
+
+ Jim Mahoney | Marlboro College | GPL
+"""
+
+import sys
+import csv
+import random
+import json
+import platform
+import argparse
+import numpy
+from LK_TSP import TSP, clock, proper_permutations, tour_constructions
+
+phases = ('setup', 'construct', 'lk', 'partition', 'anytime', 'exact',
+          'brute_force', 'render')
+
+def int_list(text):
+  """ Return the list of integers in a comma separated string.
+      >>> int_list('10,20, 40')
+      [10, 20, 40]
+  """
+  return [int(word) for word in text.split(',') if word.strip()]
+
+def median(numbers):
+  """ Return the median of a list of numbers.
+      >>> (median([3, 1, 2]), median([4, 1, 3, 2]))
+      (2, 2.5)
+  """
+  numbers = sorted(numbers)
+  middle = len(numbers) // 2
+  if len(numbers) % 2:
+    return numbers[middle]
+  return (numbers[middle - 1] + numbers[middle]) / 2.0
+
+def time_phase(run, warmup=1, repeat=3):
+  """ Return (fastest, median, result) of the times taken by run(),
+      a function of no arguments, after warmup untimed calls.
+      >>> (fastest, middle, result) = time_phase(lambda : 42, 0, 2)
+      >>> (fastest <= middle, result)
+      (True, 42)
+  """
+  for i in range(warmup):
+    run()
+  times = []
+  for i in range(repeat):
+    start = clock()
+    result = run()
+    times.append(clock() - start)
+  return (min(times), median(times), result)
+
+def random_cities(n, seed):
+  """ Return the (n,2) array of random coordinates for this seed. """
+  return numpy.random.RandomState(seed).rand(n, 2) * 100.0
+
+def benchmark(n, seed, options):
+  """ Generate a record (dictionary) of the timing of each phase
+      for one random TSP of n cities.  Python's random module, which
+      picks random tours and LK's choices, is seeded with seed too,
+      before each run of each phase.
+      >>> options = parser().parse_args(['--warmup', '0', '--repeat', '1'])
+      >>> records = list(benchmark(7, 1, options))
+      >>> sorted(set([r['phase'] for r in records])) == sorted(phases)
+      True
+      >>> lengths = dict([(r['phase'], r['length']) for r in records])
+      >>> abs(lengths['exact'] - lengths['brute_force']) < 1e-9
+      True
+      >>> options = parser().parse_args(['--phases', 'lk', '--start', 'random'])
+      >>> (first, again) = [["%.6f" % r['length']
+      ...                    for r in benchmark(100, 1, options)]
+      ...                   for i in range(2)]
+      >>> first == again
+      True
+  """
+  xy = random_cities(n, seed)
+  random.seed(seed)
+  def new_tsp(tour=None):
+    tsp = TSP(cities=xy, tour=tour, tour_engine=options.engine)
+    tsp.lk_dont_look_bits = options.dont_look_bits
+    tsp.lk_candidates = options.candidates
+    return tsp
+  def record(phase, (fastest, middle, length), detail=''):
+    return {'n': n, 'seed': seed, 'phase': phase, 'detail': detail,
+            'seconds': fastest, 'median': middle, 'length': length}
+  def measure(run):
+    def seeded_run():
+      random.seed(seed)
+      return run()
+    return time_phase(seeded_run, options.warmup, options.repeat)
+  def setup():
+    new_tsp()
+  if 'setup' in options.phases:
+    yield record('setup', measure(setup))
+  tsp = new_tsp()
+  tsp.neighbor_indices(max(tsp.lk_search_roads_per_city, 10))
+  if 'construct' in options.phases:
+    for name in sorted(tour_constructions):
+      yield record('construct', measure(lambda : tsp.new_tour(name).length),
+                   name)
+  if 'lk' in options.phases:
+    def lk():
+      tsp.tour = tsp.new_tour(options.start)
+      tsp.LK()
+      return tsp.tour_length()
+    yield record('lk', measure(lk), options.start)
+  if 'partition' in options.phases:
+    def partition():
+      tsp.partition_LK(options.cell_size, options.processes)
+      return tsp.tour_length()
+    yield record('partition', measure(partition), str(options.cell_size))
+  if 'anytime' in options.phases:
+    def anytime():
+      tsp.tour = tsp.new_tour(options.start)
+      for (length, elapsed, cities) in tsp.anytime_LK(options.anytime_seconds):
+        pass
+      return tsp.tour_length()
+    yield record('anytime', measure(anytime),
+                 '%s %gs' % (options.start, options.anytime_seconds))
+  if 'exact' in options.phases and n <= options.exact_max:
+    yield record('exact', measure(lambda : tsp.exact_tour()[0]))
+  if 'brute_force' in options.phases and n <= options.brute_force_max:
+    def brute_force():
+      return min([tsp.new_tour(p).length
+                  for p in proper_permutations(list(tsp.cities))])
+    yield record('brute_force', measure(brute_force))
+  if 'render' in options.phases:
+    def render():
+      tsp.graph(all_lines=n <= options.render_all_max)
+    yield record('render', measure(render))
+
+def run(options):
+  """ Return the list of benchmark() records for all sizes and seeds. """
+  records = []
+  for n in options.sizes:
+    for seed in options.seeds:
+      for result in benchmark(n, seed, options):
+        records.append(result)
+        if not options.quiet:
+          print >> sys.stderr, "%6i %4i  %-12s %-12s %10.4f sec  %12.4f" % \
+                (n, seed, result['phase'], result['detail'],
+                 result['seconds'], result['length'] or 0)
+  return records
+
+def environment():
+  """ Return a description of where the benchmarks were run. """
+  return {'python': platform.python_version(), 'numpy': numpy.__version__,
+          'machine': platform.machine(), 'platform': platform.platform()}
+
+def write_json(filename, options, records):
+  settings = dict([(key, value) for (key, value) in vars(options).items()
+                   if key not in ('json', 'csv', 'compare')])
+  f = open(filename, 'w')
+  json.dump({'environment': environment(), 'options': settings,
+             'records': records}, f, indent=1, sort_keys=True)
+  f.close()
+
+def write_csv(filename, records):
+  columns = ('n', 'seed', 'phase', 'detail', 'seconds', 'median', 'length')
+  f = open(filename, 'wb')
+  writer = csv.writer(f)
+  writer.writerow(columns)
+  for record in records:
+    writer.writerow([record[column] for column in columns])
+  f.close()
+
+def compare(old_records, new_records, tolerance=0.2, min_seconds=0.001):
+  """ Return a list of (key, old_seconds, new_seconds) for the phases
+      which are more than tolerance (a fraction) slower in new_records,
+      where key is (n, seed, phase, detail).  Phases that took less than
+      min_seconds are too quick to time reliably, and are skipped.
+      >>> old = [{'n': 10, 'seed': 1, 'phase': 'lk', 'detail': '',
+      ...         'seconds': 1.0}]
+      >>> new = [dict(old[0], seconds=1.5)]
+      >>> compare(old, new)
+      [((10, 1, 'lk', ''), 1.0, 1.5)]
+      >>> compare(old, new, tolerance=0.6)
+      []
+  """
+  def key(record):
+    return (record['n'], record['seed'], record['phase'], record['detail'])
+  old = dict([(key(record), record['seconds']) for record in old_records])
+  slower = []
+  for record in new_records:
+    k = key(record)
+    if k in old and record['seconds'] > max(old[k] * (1 + tolerance),
+                                            min_seconds):
+      slower.append((k, old[k], record['seconds']))
+  return sorted(slower)
+
+def parser():
+  p = argparse.ArgumentParser(description='Benchmark the TSP code.')
+  p.add_argument('--sizes', type=int_list, default=[10, 50, 200],
+                 help='comma separated numbers of cities')
+  p.add_argument('--seeds', type=int_list, default=[1],
+                 help='comma separated random seeds')
+  p.add_argument('--phases', type=lambda text: text.split(','),
+                 default=list(phases), help=','.join(phases))
+  p.add_argument('--warmup', type=int, default=1)
+  p.add_argument('--repeat', type=int, default=3)
+  p.add_argument('--engine', default='array', choices=('array', 'linked'))
+  p.add_argument('--start', default='greedy',
+                 help="LK's starting tour : random or " +
+                      ', '.join(sorted(tour_constructions)))
+  p.add_argument('--dont-look-bits', action='store_true')
+  p.add_argument('--candidates', default='nearest', choices=('nearest', 'alpha'))
+  p.add_argument('--cell-size', type=int, default=500,
+                 help='most cities in each partition_LK cell')
+  p.add_argument('--processes', type=int, default=None,
+                 help='partition_LK worker processes, -1 => one per cpu')
+  p.add_argument('--anytime-seconds', type=float, default=1.0,
+                 help='time limit for the anytime_LK phase')
+  p.add_argument('--exact-max', type=int, default=13,
+                 help='largest N for the exact (Held-Karp) phase')
+  p.add_argument('--brute-force-max', type=int, default=8,
+                 help='largest N for the brute force phase')
+  p.add_argument('--render-all-max', type=int, default=50,
+                 help='largest N to draw all roads, not just the tour')
+  p.add_argument('--json', help='write the results to this JSON file')
+  p.add_argument('--csv', help='write the results to this CSV file')
+  p.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                 help='compare two JSON results instead')
+  p.add_argument('--tolerance', type=float, default=0.2,
+                 help='fraction slower that counts as a regression')
+  p.add_argument('--min-seconds', type=float, default=0.001,
+                 help='phases quicker than this are not compared')
+  p.add_argument('--quiet', action='store_true')
+  return p
+
+def main(arguments=None):
+  options = parser().parse_args(arguments)
+  if options.compare:
+    (old, new) = [json.load(open(name))['records'] for name in options.compare]
+    slower = compare(old, new, options.tolerance, options.min_seconds)
+    for ((n, seed, phase, detail), before, after) in slower:
+      print "%6i %4i  %-12s %-12s %10.4f => %10.4f sec" % \
+            (n, seed, phase, detail, before, after)
+    return 1 if slower else 0
+  records = run(options)
+  if options.json:
+    write_json(options.json, options, records)
+  if options.csv:
+    write_csv(options.csv, records)
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+ tsplib.py
+
+ Reading traveling salesman instances from files, either
+   TSPLIB .tsp files, with a NODE_COORD_SECTION of "i x y" lines
+     and EDGE_WEIGHT_TYPE EUC_2D, ATT or GEO ; see
+     http://comopt.ifi.uni-heidelberg.de/software/TSPLIB95/tsp95.pdf
+   or plain text files of "x y" (or "i x y") lines, like coordinates.txt.
+
+ The coordinates are parsed straight into a numpy array, a few megabytes
+ of the memory-mapped file at a time, so a file of a million cities
+ loads in a second or two without ever holding all its text or
+ a million python floats.  TSP.from_file() in LK_TSP.py uses these.
+
+   >>> (header, coords) = parse_instance('''NAME : square
+   ... TYPE : TSP
+   ... DIMENSION : 4
+   ... EDGE_WEIGHT_TYPE : EUC_2D
+   ... NODE_COORD_SECTION
+   ... 1 0 0
+   ... 2 0 10.5
+   ... 3 10 10
+   ... 4 1e1 0
+   ... EOF
+   ... ''')
+   >>> header['NAME'], coords.tolist()
+   ('square', [[0.0, 0.0], [0.0, 10.5], [10.0, 10.0], [10.0, 0.0]])
+   >>> tsplib_length(header, coords, [0, 1, 2, 3])
+   41
+
+ Jim Mahoney | Marlboro College | GPL
+"""
+
+import re
+import os
+import mmap
+import math
+import numpy
+
+block_size = 1 << 22      # bytes of text parsed at a time
+
+def read_instance(filename):
+  """ Return (header, coords) for a TSPLIB or plain text file;
+      see parse_instance().
+      >>> import tempfile
+      >>> f = tempfile.NamedTemporaryFile(suffix='.txt')
+      >>> f.write('1 1 2\\n2 3 4\\n3 5 6\\n'); f.flush()
+      >>> read_instance(f.name)[1].tolist()
+      [[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]]
+  """
+  f = open(filename, 'rb')
+  try:
+    if os.fstat(f.fileno()).st_size == 0:
+      return ({}, numpy.zeros((0, 2)))
+    text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      return parse_instance(text)
+    finally:
+      text.close()
+  finally:
+    f.close()
+
+def parse_instance(text):
+  """ Return (header, coords) from the text of an instance (a string
+      or an mmap), where header is a dictionary of the TSPLIB
+      specification lines (empty for plain text) and coords is
+      the (N,2) array of the coordinates as given in the file.
+      >>> (header, coords) = parse_instance('1.5 2\\n3 4.5\\n\\n')
+      >>> header, coords.tolist()
+      ({}, [[1.5, 2.0], [3.0, 4.5]])
+      >>> parse_instance('1 2\\n3 x4\\n5 6\\n')
+      Traceback (most recent call last):
+      ValueError: expected numbers, not '3 x4'
+      >>> parse_instance('1 2 3\\n4\\n5 6\\n')
+      Traceback (most recent call last):
+      ValueError: expected lines of 'x y' or 'i x y'
+  """
+  (header, section) = ({}, False)
+  position = 0
+  while position < len(text):
+    end = line_end(text, position)
+    line = text[position:end].strip()
+    if re.match(r'[-+.\d]', line):             # plain text ; no header
+      break
+    position = end
+    if line.startswith('NODE_COORD_SECTION'):
+      section = True
+      break
+    if ':' in line:
+      (key, value) = line.split(':', 1)
+      header[key.strip()] = value.strip()
+    elif line and line != 'EOF':
+      header[line] = ''
+  if 'NODE_COORD_TYPE' in header and header['NODE_COORD_TYPE'] != 'TWOD_COORDS':
+    raise ValueError('only 2D coordinates are handled, not %s' %
+                     header['NODE_COORD_TYPE'])
+  if header and not section:
+    raise ValueError('no NODE_COORD_SECTION')
+  columns = 3 if section else len(text[position:line_end(text, position)].split())
+  if columns not in (2, 3):
+    raise ValueError("expected lines of 'x y' or 'i x y'")
+  if 'DIMENSION' in header:
+    n = int(header['DIMENSION'])
+    values = numpy.empty(n * columns)
+  else:
+    (n, values) = (None, [])
+  count = 0
+  for block in numeric_blocks(text, position):
+    numbers = numpy.fromstring(block, sep=' ')
+    if len(numbers) != columns * data_lines(block):
+      raise ValueError("expected lines of 'x y' or 'i x y'")
+    if n == None:
+      values.append(numbers)
+    elif count + len(numbers) > len(values):
+      raise ValueError('more than DIMENSION = %i cities' % n)
+    else:
+      values[count:count + len(numbers)] = numbers
+    count += len(numbers)
+  if n == None:
+    values = numpy.concatenate(values) if values else numpy.zeros(0)
+  elif count < len(values):
+    raise ValueError('only %i of DIMENSION = %i cities' % (count // columns, n))
+  return (header, values.reshape(-1, columns)[:, columns-2:].copy())
+
+def line_end(text, position):
+  """ Return the index just past the end of the line at position. """
+  end = text.find('\n', position)
+  return len(text) if end < 0 else end + 1
+
+def data_lines(block):
+  """ Return the number of lines in the block that aren't blank.
+      >>> data_lines('\\n1 2\\n \\n\\n3 4')
+      2
+  """
+  blank = len(re.findall(r'\n(?=[ \t\r]*(?:\n|$))', block))
+  if not block[:line_end(block, 0)].strip():
+    blank += 1
+  return block.count('\n') + 1 - blank
+
+def numeric_blocks(text, position):
+  """ Generate successive whole-line blocks of the text from position
+      on, up to an EOF or *_SECTION line ; any other line with letters
+      in it is a ValueError. """
+  # Other than an exponent's 'e', any letter ends the coordinates.
+  while position < len(text):
+    end = min(position + block_size, len(text))
+    if end < len(text):
+      end = text.rfind('\n', position, end) + 1 or line_end(text, position)
+    block = text[position:end]
+    letter = re.search(r'[A-DF-Za-df-z]', block)
+    if letter:
+      start = block.rfind('\n', 0, letter.start()) + 1
+      line = block[start:line_end(block, start)].strip()
+      if line != 'EOF' and not re.match(r'[A-Z_]+_SECTION$', line):
+        raise ValueError('expected numbers, not %r' % line)
+      block = block[:start]
+      if block.strip():
+        yield block
+      return
+    yield block
+    position = end
+
+# - - - distances - - -
+
+earth_radius = 6378.388   # km, as in TSPLIB
+
+def geo_radians(coords):
+  """ Return TSPLIB's GEO coordinates (degrees.minutes) in radians.
+      >>> geo_radians(numpy.array([[0.3, 10.0]])) * 180 / math.pi
+      array([[ 0.5, 10. ]])
+  """
+  degrees = numpy.trunc(coords)
+  return math.pi * (degrees + 5.0 * (coords - degrees) / 3.0) / 180.0
+
+def planar_coordinates(header, coords):
+  """ Return an (N,2) array of points whose straight line distances are
+      those of the instance, before TSPLIB rounds them to integers :
+      the coordinates themselves for EUC_2D or plain text, scaled by
+      1/sqrt(10) for ATT, and (approximately) for GEO, a projection of
+      the (latitude, longitude) onto a plane in km.
+      >>> header = {'EDGE_WEIGHT_TYPE': 'ATT'}
+      >>> xy = planar_coordinates(header, numpy.array([[0, 0], [30, 40]]))
+      >>> "%.4f = sqrt(2500/10)" % numpy.hypot(*(xy[1] - xy[0]))
+      '15.8114 = sqrt(2500/10)'
+  """
+  # The GEO projection is exact along the meridians ; elsewhere it's
+  # off by about the fractional difference in cos(latitude) across the
+  # cities, which is fine for finding tours but not for their lengths.
+  kind = header.get('EDGE_WEIGHT_TYPE', 'EUC_2D')
+  if kind in ('EUC_2D', 'CEIL_2D'):
+    return coords
+  if kind == 'ATT':
+    return coords / math.sqrt(10.0)
+  if kind == 'GEO':
+    (latitude, longitude) = geo_radians(coords).T
+    middle = math.cos((latitude.min() + latitude.max()) / 2)
+    return earth_radius * numpy.column_stack((longitude * middle, latitude))
+  raise ValueError('EDGE_WEIGHT_TYPE %s is not handled' % kind)
+
+def tsplib_distances(header, coords, i, j):
+  """ Return the integer array of TSPLIB's distances
+      between cities i[k] and j[k], for arrays of indices i and j. """
+  kind = header.get('EDGE_WEIGHT_TYPE', 'EUC_2D')
+  if kind == 'GEO':
+    (latitude, longitude) = geo_radians(coords).T
+    q1 = numpy.cos(longitude[i] - longitude[j])
+    q2 = numpy.cos(latitude[i] - latitude[j])
+    q3 = numpy.cos(latitude[i] + latitude[j])
+    d = earth_radius * numpy.arccos(0.5 * ((1 + q1) * q2 - (1 - q1) * q3)) + 1
+    return numpy.where(i == j, 0, d.astype(int))
+  delta = coords[i] - coords[j]
+  d = numpy.sqrt((delta * delta).sum(axis=1))
+  if kind == 'ATT':
+    d = d / math.sqrt(10.0)
+    rounded = numpy.floor(d + 0.5)
+    return numpy.where(rounded < d, rounded + 1, rounded).astype(int)
+  if kind == 'CEIL_2D':
+    return numpy.ceil(d).astype(int)
+  return numpy.floor(d + 0.5).astype(int)
+
+def tsplib_length(header, coords, tour):
+  """ Return the length of a tour (a sequence of city indices)
+      with TSPLIB's integer distances, as in its published optima.
+      >>> header = {'EDGE_WEIGHT_TYPE': 'GEO'}
+      >>> tsplib_length(header, numpy.array([[0.0, 0.0], [0.3, 0.0]]), [0, 1])
+      112
+  """
+  i = numpy.asarray(tour)
+  return int(tsplib_distances(header, coords, i, numpy.roll(i, -1)).sum())
+
+if __name__ == "__main__":
+  import doctest
+  doctest.testmod()